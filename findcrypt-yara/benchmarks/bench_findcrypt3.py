@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+#
+# Benchmark of the Findcrypt scan pipeline on synthetic databases. Each phase
+# of a search is timed separately:
+#
+#   snapshot   Findcrypt_Plugin_t._get_memory
+#   compile    yara.compile of the rule files
+#   load       loading the compiled rules from the cache
+#   match      rules.match over the snapshot
+#   translate  snapshot offsets to addresses
+#   naming     Findcrypt_Plugin_t.apply_names of every hit
+#   chooser    building the results chooser and formatting every line
+#   entropy    the entropy map of the snapshot (with numpy)
+#
+# Usage:
+#
+#   python benchmarks/bench_findcrypt3.py -o before.json
+#   python benchmarks/bench_findcrypt3.py --sizes 1M,1G --compare before.json
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import fakeida
+fakeida.install()
+
+import yara
+from findcrypt3 import entropy as entropymod, findcrypt3, rules as rulesmod, scanner
+from findcrypt3.results import ResultStore
+
+UNITS = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+SEGMENTS = {"few": 4, "many": 2000}
+DENSITY = {"sparse": 1, "dense": 256}  # constants per MB
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    if text[-1] in UNITS:
+        return int(text[:-1]) * UNITS[text[-1]]
+    return int(text)
+
+
+def rule_constants(path):
+    """Return the byte strings of the plain hex strings of a rule file."""
+    with open(path) as f:
+        source = f.read()
+    constants = []
+    for value in re.findall(r'=\s*\{([0-9a-fA-F\s]+)\}', source):
+        value = re.sub(r'\s', '', value)
+        if len(value) % 2 == 0:
+            constants.append(bytearray.fromhex(value))
+    return constants
+
+
+def make_database(size, nsegments, per_mb, constants, seed=0):
+    """
+    Return segments of random bytes totalling size bytes, with per_mb rule
+    constants per MB at random places.
+    """
+    rng = random.Random(seed)
+    seg_size = max(1, size // nsegments)
+    segments = []
+    ea = 0x10000
+    for i in range(nsegments):
+        segments.append((ea, bytearray(os.urandom(seg_size))))
+        ea += (seg_size + 0x1fff) & ~0xfff
+    for i in range(max(1, size * per_mb >> 20)):
+        data = rng.choice(segments)[1]
+        constant = rng.choice(constants)
+        if len(constant) < seg_size:
+            pos = rng.randrange(0, seg_size - len(constant))
+            data[pos:pos + len(constant)] = constant
+    return segments
+
+
+class Timer(object):
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.phases = {}
+
+    def run(self, phase, func, *args):
+        """Time func(*args) as phase and return its result."""
+        best = None
+        for i in range(self.repeat):
+            start = timeit.default_timer()
+            result = func(*args)
+            elapsed = timeit.default_timer() - start
+            best = elapsed if best is None else min(best, elapsed)
+        self.phases[phase] = best
+        return result
+
+
+def phase_translate(matches, memory, offsets):
+    translated = ResultStore(memory)
+    for match in matches:
+        strings = list(scanner.iter_match_strings(match))
+        eas = offsets.to_eas([string[0] for string in strings])
+        for ea, (offset, identifier, data) in zip(eas, strings):
+            translated.add(ea, match.rule, offset, len(data))
+    return translated
+
+
+def phase_chooser(values):
+    c = findcrypt3.YaraSearchResultChooser("Findcrypt results", values)
+    for n in range(c.OnGetSize()):
+        c.OnGetLine(n)
+    return c
+
+
+def phase_entropy(memory, offsets):
+    view = memoryview(memory)
+    ranges = [(start, end) for ea, start, end in offsets]
+    return list(entropymod.iter_regions(ranges, lambda start, size: view[start:start + size]))
+
+
+def bench(segments, filepaths, repeat):
+    fakeida.load(segments)
+    plugin = findcrypt3.Findcrypt_Plugin_t()
+    timer = Timer(repeat)
+
+    memory, offsets = timer.run("snapshot", plugin._get_memory)
+    rules = timer.run("compile", lambda: yara.compile(filepaths=filepaths))
+    cache_dir = tempfile.mkdtemp()
+    try:
+        rulesmod._compiled.clear()
+        rulesmod.compile_rules(filepaths, cache_dir)
+
+        def load():
+            rulesmod._compiled.clear()
+            return rulesmod.compile_rules(filepaths, cache_dir)
+        timer.run("load", load)
+    finally:
+        shutil.rmtree(cache_dir)
+    matches = timer.run("match", lambda: rules.match(data=memory))
+    values = timer.run("translate", phase_translate, matches, memory, offsets)
+    fakeida.load(segments)
+    timer.run("naming", plugin.apply_names, values)
+    timer.run("chooser", phase_chooser, values)
+    if entropymod.numpy is not None:
+        timer.run("entropy", phase_entropy, memory, offsets)
+    return timer.phases, len(values)
+
+
+def git_version():
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_run(run, previous=None):
+    line = "%-22s %7d hits" % (run["layout"], run["hits"])
+    for phase in sorted(run["phases"]):
+        line += "  %s %.3fs" % (phase, run["phases"][phase])
+        if previous and phase in previous["phases"] and previous["phases"][phase] > 0:
+            line += " (x%.2f)" % (run["phases"][phase] / previous["phases"][phase])
+    print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Findcrypt scan pipeline.")
+    parser.add_argument("--sizes", default="1M,16M,128M",
+                        help="comma separated database sizes (K, M and G suffixes)")
+    parser.add_argument("--segments", default="few,many",
+                        help="comma separated segment layouts: %s" % ", ".join(sorted(SEGMENTS)))
+    parser.add_argument("--density", default="sparse,dense",
+                        help="comma separated hit densities: %s" % ", ".join(sorted(DENSITY)))
+    parser.add_argument("--repeat", type=int, default=1, help="keep the best of N runs")
+    parser.add_argument("-o", "--output", help="store the results in this JSON file")
+    parser.add_argument("--compare", help="JSON results of a previous version to compare with")
+    args = parser.parse_args(argv)
+
+    filepaths = {"global": rulesmod.YARARULES_CFGFILE}
+    constants = rule_constants(rulesmod.YARARULES_CFGFILE)
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            for run in json.load(f)["runs"]:
+                previous[run["layout"]] = run
+
+    results = {
+        "findcrypt": findcrypt3.VERSION,
+        "git": git_version(),
+        "python": platform.python_version(),
+        "yara": getattr(yara, "__version__", None),
+        "date": datetime.datetime.now().isoformat(),
+        "runs": [],
+    }
+    for size_text in args.sizes.split(","):
+        size = parse_size(size_text)
+        for layout in args.segments.split(","):
+            for density in args.density.split(","):
+                segments = make_database(size, SEGMENTS[layout], DENSITY[density], constants)
+                phases, hits = bench(segments, filepaths, args.repeat)
+                run = {
+                    "layout": "%s/%s/%s" % (size_text, layout, density),
+                    "size": size,
+                    "segments": len(segments),
+                    "hits": hits,
+                    "phases": phases,
+                }
+                del segments
+                results["runs"].append(run)
+                print_run(run, previous.get(run["layout"]))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
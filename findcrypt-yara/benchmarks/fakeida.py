@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+#
+# In-memory stand-in for the parts of idaapi, idc and idautils used by
+# Findcrypt, so the plugin code can be timed outside of IDA. The database is
+# a list of (start ea, bytes) segments.
+
+import bisect
+import sys
+import types
+
+
+class Database(object):
+    def __init__(self, segments):
+        self.starts = [start for start, data in segments]
+        self.datas = [data for start, data in segments]
+        self.names = {}
+        self.blobs = {}
+
+    def find(self, ea):
+        i = bisect.bisect_right(self.starts, ea) - 1
+        if i >= 0 and ea < self.starts[i] + len(self.datas[i]):
+            return i
+        return -1
+
+    def get_bytes(self, ea, size):
+        i = self.find(ea)
+        if i < 0 or ea + size > self.starts[i] + len(self.datas[i]):
+            return None
+        pos = ea - self.starts[i]
+        return bytes(self.datas[i][pos:pos + size])
+
+    def get_byte(self, ea):
+        i = self.find(ea)
+        if i < 0:
+            return 0xFF
+        return bytearray(self.datas[i][ea - self.starts[i]:ea - self.starts[i] + 1])[0]
+
+
+class _Base(object):
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+class Choose2(object):
+    CHCOL_PLAIN = 0
+    CHCOL_HEX = 0x30000
+    CHCOL_DEC = 0x20000
+
+    def __init__(self, title, cols, flags=0, width=None, height=None, embedded=False):
+        self.title = title
+        self.cols = cols
+
+    def Show(self, modal=False):
+        return 0
+
+    def Refresh(self):
+        pass
+
+
+class netnode(object):
+    def __init__(self, name, namelen=0, do_create=False):
+        self.name = name
+
+    def getblob(self, start, tag):
+        return _db.blobs.get((self.name, start, tag))
+
+    def setblob(self, data, start, tag):
+        _db.blobs[(self.name, start, tag)] = data
+        return True
+
+    def delblob(self, start, tag):
+        return _db.blobs.pop((self.name, start, tag), None) is not None
+
+
+class segment_t(object):
+    type = 3  # SEG_DATA
+    perm = 6  # SEGPERM_READ | SEGPERM_WRITE
+
+
+def _set_name(ea, name, flags=0):
+    _db.names[ea] = name
+    return True
+
+
+_db = None
+
+
+def load(segments):
+    """Replace the fake database by segments and return it."""
+    global _db
+    _db = Database(segments)
+    return _db
+
+
+def _seg_end(ea):
+    i = _db.find(ea)
+    return _db.starts[i] + len(_db.datas[i])
+
+
+def install():
+    """Register the fake idaapi, idc and idautils modules."""
+    if "idaapi" in sys.modules:
+        return
+
+    idaapi = types.ModuleType("idaapi")
+    idaapi.plugin_t = _Base
+    idaapi.action_handler_t = _Base
+    idaapi.action_desc_t = _Base
+    idaapi.Choose2 = Choose2
+    idaapi.netnode = netnode
+    idaapi.set_name = _set_name
+    idaapi.register_action = lambda *args: True
+    idaapi.unregister_action = lambda *args: True
+    idaapi.attach_action_to_menu = lambda *args: True
+    idaapi.PLUGIN_KEEP = 2
+    idaapi.SN_FORCE = 0x800
+    idaapi.SN_NOWARN = 0x80
+    idaapi.refresh_idaview_anyway = lambda: None
+    idaapi.SETMENU_APP = 1
+    idaapi.BWN_DISASM = 27
+    idaapi.AST_ENABLE_FOR_FORM = 1
+    idaapi.AST_DISABLE_FOR_FORM = 3
+    idaapi.BADADDR = 0xFFFFFFFFFFFFFFFF
+    idaapi.MFF_FAST, idaapi.MFF_READ, idaapi.MFF_WRITE = 0, 1, 2
+    idaapi.execute_sync = lambda func, flags: func()
+    idaapi.SEG_XTRN, idaapi.SEG_BSS, idaapi.SEG_ABSSYM, idaapi.SEG_COMM, idaapi.SEG_IMEM = 1, 9, 10, 11, 12
+    idaapi.SEGPERM_READ = 4
+    idaapi.getseg = lambda ea: segment_t() if _db.find(ea) >= 0 else None
+    idaapi.get_segm_class = lambda seg: "DATA"
+    idaapi.has_value = lambda flags: True
+    idaapi.next_that = lambda ea, maxea, testf: ea + 1 if ea + 1 < maxea else idaapi.BADADDR
+    idaapi.prev_that = lambda ea, minea, testf: ea - 1 if ea - 1 >= minea else idaapi.BADADDR
+
+    idc = types.ModuleType("idc")
+    idc.Byte = lambda ea: _db.get_byte(ea)
+    idc.isLoaded = lambda ea: _db.find(ea) >= 0
+    idc.GetManyBytes = lambda ea, size, use_dbg=False: _db.get_bytes(ea, size)
+    idc.SegEnd = _seg_end
+    idc.Name = lambda ea: _db.names.get(ea, "")
+    idc.Jump = lambda ea: True
+    idc.atoa = lambda ea: "%X" % ea
+    idc.BADADDR = idaapi.BADADDR
+
+    idautils = types.ModuleType("idautils")
+    idautils.Segments = lambda: iter(list(_db.starts))
+
+    sys.modules["idaapi"] = idaapi
+    sys.modules["idc"] = idc
+    sys.modules["idautils"] = idautils
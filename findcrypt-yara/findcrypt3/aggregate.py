@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+#
+# Aggregation of search hits into address ranges and per-rule summaries.
+
+import collections
+
+HitRange = collections.namedtuple("HitRange", ["start", "end", "rule", "count"])
+
+RuleSummary = collections.namedtuple(
+    "RuleSummary", ["rule", "hits", "ranges", "coverage", "first", "last"])
+
+
+def aggregate(spans, gap=0):
+    """
+    Merge the (ea, rule, length) spans of the hits of each rule which
+    overlap or are at most gap bytes apart. Return the HitRanges sorted by
+    start address. Spans are sorted once and merged in a single pass.
+    """
+    ranges = []
+    current = None
+    for ea, rule, length in sorted(spans, key=lambda span: (span[1], span[0])):
+        end = ea + max(length, 1)
+        if current is not None and current[2] == rule and ea <= current[1] + gap:
+            current[1] = max(current[1], end)
+            current[3] += 1
+        else:
+            if current is not None:
+                ranges.append(HitRange(*current))
+            current = [ea, end, rule, 1]
+    if current is not None:
+        ranges.append(HitRange(*current))
+    ranges.sort()
+    return ranges
+
+
+def summarize(ranges):
+    """
+    Return a RuleSummary per rule, with the number of hits and ranges and
+    the number of bytes covered, sorted by decreasing number of hits.
+    """
+    summaries = {}
+    for r in ranges:
+        s = summaries.get(r.rule)
+        if s is None:
+            summaries[r.rule] = [r.count, 1, r.end - r.start, r.start, r.end]
+        else:
+            s[0] += r.count
+            s[1] += 1
+            s[2] += r.end - r.start
+            s[3] = min(s[3], r.start)
+            s[4] = max(s[4], r.end)
+    return sorted((RuleSummary(rule, *s) for rule, s in summaries.items()),
+                  key=lambda s: (-s.hits, s.rule))
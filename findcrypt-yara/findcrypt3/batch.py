@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+#
+# Headless Findcrypt: scan files with the Findcrypt rules without IDA and
+# write the hits as JSON Lines.
+#
+#   python -m findcrypt3.batch -o hits.jsonl samples/
+
+import argparse
+import binascii
+import json
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+
+from . import rules as rulesmod
+from . import scanner
+from .segmap import SegmentMap
+
+PT_LOAD = 1
+SHF_ALLOC = 0x2
+SHT_NOBITS = 8
+
+
+def _elf_ranges(data):
+    """Return (file offset, size, vaddr) of the loaded parts of an ELF file."""
+    endian = "<" if data[5:6] == b"\x01" else ">"
+    if data[4:5] == b"\x02":
+        phoff, shoff = struct.unpack_from(endian + "QQ", data, 32)
+        phentsize, phnum, shentsize, shnum = struct.unpack_from(endian + "HHHH", data, 54)
+        phdr, shdr = "IIQQQQ", "IIQQQQ"
+    else:
+        phoff, shoff = struct.unpack_from(endian + "II", data, 28)
+        phentsize, phnum, shentsize, shnum = struct.unpack_from(endian + "HHHH", data, 42)
+        phdr, shdr = "IIIIIIII", "IIIIII"
+    ranges = []
+    for i in range(phnum):
+        fields = struct.unpack_from(endian + phdr, data, phoff + i * phentsize)
+        if data[4:5] == b"\x02":
+            p_type, p_flags, p_offset, p_vaddr, p_paddr, p_filesz = fields
+        else:
+            p_type, p_offset, p_vaddr, p_paddr, p_filesz = fields[:5]
+        if p_type == PT_LOAD:
+            ranges.append((p_offset, p_filesz, p_vaddr))
+    if ranges:
+        return ranges
+    # Relocatable objects have no program headers, use the sections
+    for i in range(shnum):
+        fields = struct.unpack_from(endian + shdr, data, shoff + i * shentsize)
+        sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size = fields
+        if sh_flags & SHF_ALLOC and sh_type != SHT_NOBITS:
+            ranges.append((sh_offset, sh_size, sh_addr))
+    return ranges
+
+
+def _pe_ranges(data):
+    """Return (file offset, size, vaddr) of the headers and sections of a PE file."""
+    pe = struct.unpack_from("<I", data, 0x3c)[0]
+    nsections, = struct.unpack_from("<H", data, pe + 6)
+    optsize, = struct.unpack_from("<H", data, pe + 20)
+    opt = pe + 24
+    magic, = struct.unpack_from("<H", data, opt)
+    if magic == 0x20b:
+        image_base, = struct.unpack_from("<Q", data, opt + 24)
+    else:
+        image_base, = struct.unpack_from("<I", data, opt + 28)
+    headers_size, = struct.unpack_from("<I", data, opt + 60)
+    ranges = [(0, headers_size, image_base)]
+    for i in range(nsections):
+        vsize, vaddr, rawsize, rawptr = struct.unpack_from(
+            "<IIII", data, opt + optsize + i * 40 + 8)
+        ranges.append((rawptr, min(rawsize, vsize or rawsize), image_base + vaddr))
+    return ranges
+
+
+def file_segments(data, base=0):
+    """
+    Return a SegmentMap from file offsets to virtual addresses for the
+    content of a file. ELF and PE files are mapped as the loader would, any
+    other file is mapped in one piece at base.
+    """
+    ranges = []
+    try:
+        if data[:4] == b"\x7fELF":
+            ranges = _elf_ranges(data)
+        elif data[:2] == b"MZ" and data[struct.unpack_from("<I", data, 0x3c)[0]:][:4] == b"PE\0\0":
+            ranges = _pe_ranges(data)
+    except struct.error:
+        ranges = []
+    if not ranges:
+        ranges = [(0, len(data), base)]
+    segments = SegmentMap()
+    last_end = 0
+    for offset, size, ea in sorted(ranges):
+        end = min(offset + size, len(data))
+        # Parts of the file mapped twice are only kept the first time
+        start = max(offset, last_end)
+        if start >= end:
+            continue
+        segments.add(ea + (start - offset), start, end)
+        last_end = end
+    return segments
+
+
+def scan_file(path, rules, base=0):
+    """Return the hits of rules in the file at path as JSON serializable dicts."""
+    records = []
+    if os.path.getsize(path) == 0:
+        return records
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            segments = file_segments(data, base)
+            matches = rules.match(data=data)
+        finally:
+            data.close()
+    for match in matches:
+        strings = list(scanner.iter_match_strings(match))
+        eas = segments.to_eas([string[0] for string in strings])
+        for ea, (offset, identifier, value) in zip(eas, strings):
+            records.append({
+                "file": path,
+                "offset": offset,
+                "ea": ea,
+                "rule": match.rule,
+                "identifier": identifier,
+                "data": binascii.hexlify(value).decode("ascii"),
+            })
+    return records
+
+
+_worker_rules = None
+_worker_base = 0
+
+
+def _worker_init(filepaths, cache_dir, base):
+    global _worker_rules, _worker_base
+    _worker_rules = rulesmod.compile_rules(filepaths, cache_dir)
+    _worker_base = base
+
+
+def _worker_scan(path):
+    try:
+        return scan_file(path, _worker_rules, _worker_base)
+    except Exception as e:
+        return [{"file": path, "error": str(e)}]
+
+
+def iter_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def scan_paths(paths, output, filepaths=None, cache_dir=rulesmod.CACHEDIR,
+               workers=None, base=0):
+    """
+    Scan every file of paths (directories are walked) on a process pool and
+    write one JSON line per hit to output as files complete. Return the
+    number of hits written.
+    """
+    if filepaths is None:
+        filepaths = rulesmod.default_filepaths()
+    # Compile once here so the workers only have to load the cache
+    rulesmod.compile_rules(filepaths, cache_dir)
+    pool = multiprocessing.Pool(workers or scanner.default_workers(), _worker_init,
+                                (filepaths, cache_dir, base))
+    count = 0
+    try:
+        for records in pool.imap_unordered(_worker_scan, iter_files(paths), 16):
+            for record in records:
+                output.write(json.dumps(record, sort_keys=True) + "\n")
+                if "error" not in record:
+                    count += 1
+    finally:
+        pool.terminate()
+        pool.join()
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Scan files for crypto constants with the Findcrypt rules.")
+    parser.add_argument("paths", nargs="+", help="files or directories to scan")
+    parser.add_argument("-o", "--output", help="JSON Lines output file (default: stdout)")
+    parser.add_argument("-r", "--rules", action="append",
+                        help="rule file to use instead of the Findcrypt and user rules")
+    parser.add_argument("-j", "--jobs", type=int, help="number of worker processes")
+    parser.add_argument("--base", type=lambda x: int(x, 0), default=0,
+                        help="load address of files which are not ELF or PE")
+    args = parser.parse_args(argv)
+
+    filepaths = None
+    if args.rules:
+        filepaths = dict((os.path.basename(fpath), fpath) for fpath in args.rules)
+    output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        count = scan_paths(args.paths, output, filepaths, workers=args.jobs, base=args.base)
+    finally:
+        if args.output:
+            output.close()
+    sys.stderr.write("%d hits\n" % count)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# Differences between the hits of two scans, e.g. two builds of a firmware.
+# Hits are put in hash tables keyed by their rule and matched bytes, so only
+# hits of the same key are compared: a hit found at the same address in both
+# scans is unchanged, one found at another address has been relocated.
+
+import binascii
+import collections
+import csv
+import json
+
+ADDED = "added"
+REMOVED = "removed"
+RELOCATED = "relocated"
+
+# Address shifts tried when a key has several hits, most common first.
+MAX_SHIFTS = 8
+
+# old_ea is None for added hits, new_ea for removed ones.
+Change = collections.namedtuple("Change", ["kind", "rule", "old_ea", "new_ea", "data"])
+
+Diff = collections.namedtuple("Diff", ["changes", "unchanged"])
+
+
+def _index(hits):
+    """Return the addresses of the (ea, rule, data) hits, by (rule, data)."""
+    index = collections.defaultdict(list)
+    for ea, rule, data in hits:
+        index[(rule, bytes(data))].append(ea)
+    return index
+
+
+def diff_hits(old, new):
+    """
+    Compare two iterables of (ea, rule, data) hits and return a Diff: the
+    Changes sorted by address and the number of unchanged hits. Hits are
+    looked up by the hash of their rule and bytes. Hits of a key left
+    unpaired at the same address are paired first when they moved by one
+    of the shifts seen on the keys with a single hit, then in address
+    order. The time is linear in the number of hits, apart from sorting
+    the hits of each key.
+    """
+    old_index = _index(old)
+    new_index = _index(new)
+    changes = []
+    unchanged = 0
+    pending = []
+    shifts = collections.Counter()
+    for key in set(old_index) | set(new_index):
+        old_eas = old_index.get(key, ())
+        new_eas = new_index.get(key, ())
+        if len(old_eas) == 1 and len(new_eas) == 1:
+            if old_eas[0] == new_eas[0]:
+                unchanged += 1
+            else:
+                shifts[new_eas[0] - old_eas[0]] += 1
+                changes.append(Change(RELOCATED, key[0], old_eas[0], new_eas[0], key[1]))
+            continue
+        old_eas = set(old_eas)
+        new_eas = set(new_eas)
+        same = old_eas & new_eas
+        unchanged += len(same)
+        if len(same) < len(old_eas) or len(same) < len(new_eas):
+            pending.append((key[0], key[1], old_eas - same, new_eas - same))
+    common = [shift for shift, count in shifts.most_common(MAX_SHIFTS)]
+    for rule, data, old_eas, new_eas in pending:
+        for shift in common:
+            if not old_eas or not new_eas:
+                break
+            for old_ea in sorted(old_eas):
+                if old_ea + shift in new_eas:
+                    old_eas.remove(old_ea)
+                    new_eas.remove(old_ea + shift)
+                    changes.append(Change(RELOCATED, rule, old_ea, old_ea + shift, data))
+        old_eas, new_eas = sorted(old_eas), sorted(new_eas)
+        paired = min(len(old_eas), len(new_eas))
+        for old_ea, new_ea in zip(old_eas, new_eas):
+            changes.append(Change(RELOCATED, rule, old_ea, new_ea, data))
+        for old_ea in old_eas[paired:]:
+            changes.append(Change(REMOVED, rule, old_ea, None, data))
+        for new_ea in new_eas[paired:]:
+            changes.append(Change(ADDED, rule, None, new_ea, data))
+    changes.sort(key=lambda change: (change.old_ea if change.new_ea is None else change.new_ea,
+                                     change.rule))
+    return Diff(changes, unchanged)
+
+
+def load_export(path):
+    """
+    Return the hits of a file written by the export or by the batch mode as
+    a list of (ea, rule, data) tuples, and the number of hits left out as
+    they have no address (file bytes not loaded in batch mode). CSV files
+    are recognized by their extension.
+    """
+    hits = []
+    skipped = 0
+    with open(path) as f:
+        if path.lower().endswith(".csv"):
+            records = csv.DictReader(f)
+        else:
+            records = (json.loads(line) for line in f if line.strip())
+        for record in records:
+            if "error" in record:
+                continue
+            if record["ea"] is None or record["ea"] == "":
+                skipped += 1
+                continue
+            hits.append((int(record["ea"]), record["rule"], binascii.unhexlify(record["data"])))
+    return hits, skipped
+
+
+def count_changes(changes):
+    """Return the number of changes of each kind, as a dict."""
+    counts = dict((kind, 0) for kind in (ADDED, REMOVED, RELOCATED))
+    for change in changes:
+        counts[change.kind] += 1
+    return counts
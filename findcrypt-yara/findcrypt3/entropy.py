@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#
+# Map of the Shannon entropy of the bytes, to find compressed or encrypted
+# data and key material no rule matches. Needs numpy.
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .results import _to_bytes
+
+# Entropy is measured on windows of WINDOW bytes every STEP bytes.
+WINDOW = 0x400
+STEP = 0x100
+
+# Bits per byte above which a window is part of a high entropy region.
+# Random bytes are about 7.8 on 1 KB windows, code below 6.5.
+THRESHOLD = 7.2
+
+# Regions smaller than this are not reported.
+MIN_SIZE = 0x800
+
+# Bytes read and histogrammed at once.
+CHUNK_SIZE = 0x100000
+
+# First bytes kept of every region, shown in the results.
+HEAD_SIZE = 16
+
+
+def window_entropy(data, window=WINDOW, step=STEP):
+    """
+    Return the entropy in bits per byte of the windows of data starting
+    every step bytes, as a numpy array. window must be a multiple of step;
+    only whole windows are measured.
+    """
+    buf = numpy.frombuffer(data, dtype=numpy.uint8)
+    k = window // step
+    blocks = len(buf) // step
+    if blocks < k:
+        return numpy.zeros(0)
+    # Byte histogram of every step bytes, summed over k consecutive steps
+    index = buf[:blocks * step].reshape(blocks, step) + \
+        (numpy.arange(blocks, dtype=numpy.uint32) << 8)[:, None]
+    counts = numpy.bincount(index.ravel(), minlength=blocks << 8)
+    counts = counts.astype(numpy.uint16).reshape(blocks, 256)
+    n = blocks - k + 1
+    windows = counts[:n].copy()
+    for j in range(1, k):
+        windows += counts[j:j + n]
+    # H = log2(window) - sum(c * log2(c)) / window
+    clog = numpy.arange(window + 1, dtype=numpy.float64)
+    clog[1:] *= numpy.log2(clog[1:])
+    clog = clog.astype(numpy.float32)
+    return numpy.log2(window) - numpy.take(clog, windows).sum(axis=1, dtype=numpy.float64) / window
+
+
+class RegionTracker(object):
+    """
+    Find the high entropy regions of bytes fed in increasing address order,
+    as read by a scan. Bytes fed again are skipped, so overlapping chunks
+    can be fed as they are; a gap ends the regions in progress. regions
+    holds (start, end, entropy, head) for the regions found so far, where
+    entropy is the mean of their windows and head their first HEAD_SIZE
+    bytes.
+    """
+
+    def __init__(self, threshold=THRESHOLD, window=WINDOW, step=STEP, min_size=MIN_SIZE):
+        self.threshold = threshold
+        self.window = window
+        self.step = step
+        self.min_size = min_size
+        self.regions = []
+        # Bytes fed from address start whose windows are not measured yet
+        self.start = None
+        self.pending = b""
+        self.region = None
+
+    def feed(self, address, data):
+        if self.start is not None and address > self.start + len(self.pending):
+            self.flush()
+        if self.start is None:
+            self.start = address
+        skip = self.start + len(self.pending) - address
+        if skip >= len(data):
+            return
+        self.pending += _to_bytes(data[skip:])
+        self._measure()
+
+    def flush(self):
+        """End the regions in progress, the next bytes fed start anew."""
+        self._close()
+        self.start = None
+        self.pending = b""
+
+    def finish(self):
+        """Flush and return the regions found since the last call."""
+        self.flush()
+        regions, self.regions = self.regions, []
+        return regions
+
+    def _measure(self):
+        entropy = window_entropy(self.pending, self.window, self.step)
+        # Runs of consecutive windows above threshold
+        edges = numpy.diff(numpy.concatenate(([0], entropy >= self.threshold, [0])).astype(numpy.int8))
+        sums = numpy.concatenate(([0.0], numpy.cumsum(entropy)))
+        for first, last in zip(numpy.flatnonzero(edges == 1).tolist(),
+                               numpy.flatnonzero(edges == -1).tolist()):
+            run_start = self.start + first * self.step
+            run_end = self.start + (last - 1) * self.step + self.window
+            total = sums[last] - sums[first]
+            region = self.region
+            if region is not None and run_start <= region[1]:
+                region[1] = run_end
+                region[2] += total
+                region[3] += last - first
+                continue
+            self._close()
+            head = self.pending[first * self.step:first * self.step + HEAD_SIZE]
+            self.region = [run_start, run_end, total, last - first, head]
+        consumed = len(entropy) * self.step
+        self.pending = self.pending[consumed:]
+        self.start += consumed
+
+    def _close(self):
+        region = self.region
+        if region is not None and region[1] - region[0] >= self.min_size:
+            self.regions.append((region[0], region[1], region[2] / region[3], region[4]))
+        self.region = None
+
+
+def iter_regions(ranges, read, threshold=THRESHOLD, window=WINDOW, step=STEP,
+                 min_size=MIN_SIZE, chunk_size=CHUNK_SIZE):
+    """
+    Yield (start, end, entropy, head) for the high entropy regions of the
+    address ranges, see RegionTracker. read(address, size) must return the
+    bytes of [address, address + size) and is called with consecutive
+    chunks of each range.
+    """
+    tracker = RegionTracker(threshold, window, step, min_size)
+    for start, end in ranges:
+        for pos in range(start, end, chunk_size):
+            tracker.feed(pos, read(pos, min(chunk_size, end - pos)))
+            for region in tracker.regions:
+                yield region
+            del tracker.regions[:]
+        for region in tracker.finish():
+            yield region
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+#
+# Export of search hits to JSON Lines or CSV. Hits are written one at a time
+# as the scan produces them, so the hits of a search are never all held in
+# memory.
+
+import binascii
+import csv
+import io
+import json
+import sys
+
+from .rules import rule_info, split_rules
+
+FORMAT_JSONL = "jsonl"
+FORMAT_CSV = "csv"
+
+FIELDS = ["ea", "segment", "rule", "identifier", "data", "meta"]
+
+
+def format_for(path):
+    """Export format matching the extension of path, JSON Lines by default."""
+    return FORMAT_CSV if path.lower().endswith(".csv") else FORMAT_JSONL
+
+
+def open_output(path):
+    """Open path for writing text lines as the csv module expects them."""
+    if sys.version_info[0] < 3:
+        return open(path, "wb")
+    return io.open(path, "w", newline="")
+
+
+def rule_meta(filepaths):
+    """Return the meta of every rule of the rule files, by rule name."""
+    meta = {}
+    for namespace in sorted(filepaths):
+        with open(filepaths[namespace]) as f:
+            header, blocks = split_rules(f.read())
+        for name, block in blocks:
+            meta[name] = rule_info(block)[1]
+    return meta
+
+
+class HitWriter(object):
+    """
+    Write Hits (address being an ea) to output, a text file, as records of
+    FIELDS. meta is the rule name to meta mapping of rule_meta, and
+    segment_name(ea) returns the name of the segment of an ea. count is the
+    number of hits written so far.
+    """
+
+    def __init__(self, output, fmt=FORMAT_JSONL, meta=None, segment_name=None):
+        if fmt not in (FORMAT_JSONL, FORMAT_CSV):
+            raise ValueError("unknown export format: %s" % fmt)
+        self.output = output
+        self.fmt = fmt
+        self.meta = meta or {}
+        self.segment_name = segment_name
+        self.count = 0
+        self.csv = None
+        if fmt == FORMAT_CSV:
+            self.csv = csv.writer(output)
+            self.csv.writerow(FIELDS)
+
+    def write(self, hit):
+        record = {
+            "ea": hit.address,
+            "segment": self.segment_name(hit.address) if self.segment_name else "",
+            "rule": hit.rule,
+            "identifier": hit.identifier,
+            "data": binascii.hexlify(hit.data).decode("ascii"),
+            "meta": self.meta.get(hit.rule, {}),
+        }
+        if self.csv is None:
+            self.output.write(json.dumps(record, sort_keys=True) + "\n")
+        else:
+            record["meta"] = json.dumps(record["meta"], sort_keys=True)
+            self.csv.writerow([record[field] for field in FIELDS])
+        self.count += 1
+
+
+def write_hits(hits, output, fmt=FORMAT_JSONL, meta=None, segment_name=None):
+    """Write every hit of the hits iterable to output, return their number."""
+    writer = HitWriter(output, fmt, meta, segment_name)
+    for hit in hits:
+        writer.write(hit)
+    return writer.count
@@ -3,22 +3,70 @@
 import idaapi
 import idautils
 import idc
+import binascii
+import bisect
+import collections
+import hashlib
+import json
+import mmap
 import operator
+import re
+import threading
 import yara
 import os
-import glob
 
-VERSION = "0.2"
-YARARULES_CFGFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "findcrypt3.rules")
-
-USRDIR = os.path.join(os.getenv('HOME'), ".yara")
-if not os.path.exists(USRDIR):
-    os.makedirs(USRDIR)
+from . import aggregate
+from . import diff as diffmod
+from . import entropy as entropymod
+from . import export as exportmod
+from . import hitcache
+from . import immediates
+from . import rules as rulesmod
+from .rules import YARARULES_CFGFILE, USRDIR, USRCFG, CACHEDIR
+from . import scanner
+from . import shard
+from . import watch
+from .results import ResultStore
+from .segmap import SegmentMap
 
-USRCFG = {}
-for fpath in glob.glob(os.path.join(USRDIR, "*.rules")):
-    name = os.path.basename(fpath)
-    USRCFG[name] = fpath
+VERSION = "0.2"
+SNAPSHOT_BLOCK_SIZE = 0x100000
+SNAPSHOT_MIN_BLOCK_SIZE = 0x100
+CHOOSER_LINE_CACHE_SIZE = 256
+SCAN_MODE_SNAPSHOT = "snapshot"
+SCAN_MODE_STREAM = "stream"
+SCAN_MODE_PARALLEL = "parallel"
+SCAN_MODE_INCREMENTAL = "incremental"
+SCAN_MODE_MMAP = "mmap"
+SCAN_MODE_BACKGROUND = "background"
+SCAN_MODE_CACHED = "cached"
+SCAN_MODE_SHARDED = "sharded"
+# Rule name of the high entropy regions in the results.
+ENTROPY_RULE = "High_Entropy"
+# Suffix of the rule name of the constants found in instruction operands.
+CODE_CONSTANT_SUFFIX = " (code)"
+# Operands looked at per instruction
+MAX_OPERANDS = 6
+# SQLite hit cache of the cached mode, shared by all databases
+HIT_CACHE_FILE = os.path.join(CACHEDIR, "hits.sqlite")
+# Milliseconds between two rescans of the patched bytes in watch mode
+WATCH_INTERVAL = 1000
+# Seconds the plugin termination waits for a background search to stop
+BACKGROUND_STOP_TIMEOUT = 5
+NAMING_FIRST = "first"
+NAMING_PER_RULE = "rule"
+NAMING_NONE = "none"
+# Segments are skipped if their type (idaapi.SEG_* names) or class is listed,
+# if they are not readable, have no loaded bytes or are larger than max_size.
+DEFAULT_SEGMENT_FILTER = {
+    "skip_types": ["SEG_XTRN", "SEG_BSS", "SEG_ABSSYM", "SEG_COMM", "SEG_IMEM"],
+    "skip_classes": ["BSS", "STACK", "XTRN", "EXTERN", "ABS", "COMMON"],
+    "readable_only": True,
+    "loaded_only": True,
+    "max_size": None,
+}
+FINDCRYPT_NETNODE = "$ findcrypt3"
+RESULTS_VERSION = 1
 
 try:
     class Kp_Menu_Context(idaapi.action_handler_t):
@@ -67,6 +115,49 @@ try:
             self.plugin.search()
             return 1
 
+    class ResultsViewer(Kp_Menu_Context):
+        def activate(self, ctx):
+            self.plugin.show_results()
+            return 1
+
+    class GroupedResultsViewer(Kp_Menu_Context):
+        def activate(self, ctx):
+            self.plugin.show_grouped()
+            return 1
+
+    class Exporter(Kp_Menu_Context):
+        def activate(self, ctx):
+            self.plugin.export()
+            return 1
+
+    class DiffViewer(Kp_Menu_Context):
+        def activate(self, ctx):
+            path = idc.AskFile(0, "*.jsonl;*.csv", "Previous Findcrypt export")
+            if path:
+                self.plugin.diff(path)
+            return 1
+
+    class WatchToggler(Kp_Menu_Context):
+        def activate(self, ctx):
+            self.plugin.watch(self.plugin.watcher is None)
+            return 1
+
+    class SearchCanceller(Kp_Menu_Context):
+        def activate(self, ctx):
+            self.plugin.cancel_search()
+            return 1
+
+    class PatchHooks(idaapi.IDB_Hooks):
+        """Report every patched byte to a PatchWatcher."""
+
+        def __init__(self, watcher):
+            idaapi.IDB_Hooks.__init__(self)
+            self.watcher = watcher
+
+        def byte_patched(self, ea, *args):
+            self.watcher.mark(ea)
+            return 0
+
 except:
     pass
 
@@ -86,6 +177,48 @@ def lrange(num1, num2=None, step=1):
 
 p_initialized = False
 
+_NAME_SUFFIX_RE = re.compile(r"^(_\d+)?$")
+
+def load_blob(tag):
+    """Return the JSON object stored in the Findcrypt netnode under tag, or None."""
+    node = idaapi.netnode(FINDCRYPT_NETNODE, 0, True)
+    blob = node.getblob(0, tag)
+    if not blob:
+        return None
+    return json.loads(blob.decode("utf-8"))
+
+def save_blob(tag, obj):
+    node = idaapi.netnode(FINDCRYPT_NETNODE, 0, True)
+    node.delblob(0, tag)
+    if obj is not None:
+        node.setblob(json.dumps(obj).encode("utf-8"), 0, tag)
+
+def load_results():
+    """
+    Return the results stored in the database by the last incremental
+    search, or None.
+    """
+    state = load_blob("R")
+    if state is None or state.get("version") != RESULTS_VERSION:
+        return None
+    return state
+
+def save_results(state):
+    state["version"] = RESULTS_VERSION
+    save_blob("R", state)
+
+def stored_values(state):
+    values = ResultStore()
+    for seg in state["segments"]:
+        for ea, rule, identifier, data in seg["hits"]:
+            values.add_data(ea, str(rule), binascii.unhexlify(data))
+    return values
+
+
+def _is_yara_rule(rule):
+    """False for the rows of high entropy regions and of constants in code."""
+    return rule != ENTROPY_RULE and not rule.endswith(CODE_CONSTANT_SUFFIX)
+
 
 
 class YaraSearchResultChooser(idaapi.Choose2):
@@ -105,19 +238,31 @@ class YaraSearchResultChooser(idaapi.Choose2):
         self.items = items
         self.selcount = 0
         self.n = len(items)
+        self.lines = collections.OrderedDict()
 
     def OnClose(self):
         return
 
     def OnSelectLine(self, n):
         self.selcount += 1
-        idc.Jump(self.items[n][0])
+        idc.Jump(self.items.ea(n))
 
     def OnGetLine(self, n):
-        res = self.items[n]
-        res = [idc.atoa(res[0]), res[1], res[2]]
+        # Lines are only formatted when IDA displays them, the last ones
+        # are kept for scrolling back and forth
+        res = self.lines.pop(n, None)
+        if res is None:
+            res = [idc.atoa(self.items.ea(n)), self.items.rule(n), repr(self.items.data(n))]
+            if len(self.lines) >= CHOOSER_LINE_CACHE_SIZE:
+                self.lines.popitem(last=False)
+        self.lines[n] = res
         return res
 
+    def invalidate(self):
+        """Refresh the chooser after rows were removed or reordered."""
+        self.lines.clear()
+        self.Refresh()
+
     def OnGetSize(self):
         n = len(self.items)
         return n
@@ -125,6 +270,239 @@ class YaraSearchResultChooser(idaapi.Choose2):
     def show(self):
         return self.Show() >= 0
 
+class SearchCancelled(Exception):
+    pass
+
+class BackgroundSearch(threading.Thread):
+    """
+    Stream search running in a worker thread, so IDA stays usable. Only
+    matching runs in the thread: reading bytes, naming and chooser updates
+    are run on the main thread with execute_sync. The results chooser is
+    shown at once and gets the hits of each segment as it is done.
+    """
+
+    def __init__(self, plugin, rules, overlap, budget=None):
+        threading.Thread.__init__(self, name="findcrypt3")
+        self.daemon = True
+        self.plugin = plugin
+        self.rules = rules
+        self.overlap = overlap
+        self.budget = budget
+        self.cancelled = threading.Event()
+        self.stopped = threading.Event()
+        self.values = ResultStore()
+        # High entropy rows, added after the names are written
+        self.entropy_rows = []
+        self.chooser = YaraSearchResultChooser("Findcrypt results", self.values)
+        self.chooser.show()
+
+    def _sync(self, func, flags=idaapi.MFF_WRITE):
+        """
+        Run func on the main thread and return its result. Once the search
+        is stopped, func is not run any more.
+        """
+        result = []
+
+        def wrapper():
+            if not self.stopped.is_set():
+                result.append(func())
+            return 1
+
+        idaapi.execute_sync(wrapper, flags)
+        return result[0] if result else None
+
+    def _read(self, buf, ea, size):
+        if self.cancelled.is_set():
+            raise SearchCancelled()
+        self._sync(lambda: self.plugin._copy_bytes(buf, 0, ea, size), idaapi.MFF_READ)
+        return memoryview(buf)[:size]
+
+    def _start(self):
+        print(">>> start yara background search")
+        return self.plugin._segments()
+
+    def _add(self, hits, n, count):
+        for hit in hits:
+            self.values.add_data(hit.address, hit.rule, hit.data)
+        self.chooser.Refresh()
+        print("Findcrypt: segment %d/%d done, %d hits" % (n, count, len(self.values)))
+
+    def _finish(self, message):
+        print(message)
+        written = self.plugin.apply_names(self.values)
+        print("%d names written" % written)
+        self.plugin._add_entropy_rows(self.values, self.entropy_rows)
+        self.plugin._add_code_constants(self.values)
+        self.plugin.last_values = self.values
+        if self.budget is not None and self.budget.cut_count():
+            print("Search cut short, results are partial:")
+            print(self.budget.summary(idc.atoa))
+        self.chooser.Refresh()
+        if self.plugin.grouped:
+            self.plugin.show_grouped(self.values)
+
+    def stop(self, timeout=BACKGROUND_STOP_TIMEOUT):
+        """
+        Cancel the search for good, when the plugin terminates: nothing is
+        run on the main thread any more, results included, and the thread
+        is joined. The main thread cannot serve execute_sync while joining,
+        so a thread waiting for it is only waited for timeout seconds.
+        """
+        self.stopped.set()
+        self.cancelled.set()
+        self.join(timeout)
+
+    def run(self):
+        message = "<<< end yara background search"
+        try:
+            segments = self._sync(self._start, idaapi.MFF_READ)
+            buf = bytearray(scanner.CHUNK_SIZE + self.overlap + 1)
+            tracker = self.plugin._entropy_tracker()
+            read = self.plugin._tracked(lambda ea, size: self._read(buf, ea, size), tracker)
+            for n, (start, end) in enumerate(segments, 1):
+                hits = list(scanner.iter_stream_hits(
+                    self.rules, [(start, end)], read, overlap=self.overlap, budget=self.budget))
+                self.entropy_rows.extend(self.plugin._entropy_rows(tracker))
+                self._sync(lambda: self._add(hits, n, len(segments)))
+        except SearchCancelled:
+            message = "<<< yara background search cancelled, results are partial"
+        except Exception as e:
+            message = "<<< yara background search failed: %s" % e
+        self._sync(lambda: self._finish(message))
+
+class PatchWatcher(object):
+    """
+    Watch mode: patched bytes are recorded as dirty ranges by IDB hooks and
+    a timer rescans the bytes around them on the main thread. The hits
+    starting where a changed byte may be part of a match are replaced in
+    values, their names updated and the results chooser refreshed. High
+    entropy and code constant rows are left as they are.
+    """
+
+    def __init__(self, plugin, rules, overlap, values):
+        self.plugin = plugin
+        self.rules = rules
+        self.overlap = overlap
+        self.values = values
+        self.dirty = watch.DirtyRanges()
+        self.chooser = YaraSearchResultChooser("Findcrypt results", values)
+        self.chooser.show()
+        self.hooks = PatchHooks(self)
+        self.hooks.hook()
+        self.timer = idaapi.register_timer(WATCH_INTERVAL, self._tick)
+
+    def mark(self, ea):
+        self.dirty.add(ea, ea + 1)
+
+    def stop(self):
+        self.hooks.unhook()
+        idaapi.unregister_timer(self.timer)
+
+    def _tick(self):
+        if len(self.dirty):
+            self.rescan()
+        return WATCH_INTERVAL
+
+    def rescan(self):
+        """Rescan the dirty ranges now."""
+        units = watch.rescan_units(self.dirty.pop_all(), self.plugin._segments(), self.overlap)
+        removed = self.values.discard([(own_start, own_end) for own_start, own_end, _, _ in units],
+                                      _is_yara_rule)
+        found = ResultStore()
+        for own_start, own_end, win_start, win_end in units:
+            buf = bytearray(win_end - win_start)
+            self.plugin._copy_bytes(buf, 0, win_start, len(buf))
+            for hit in scanner.scan_chunk(self.rules, buf, win_start, own_start, own_end):
+                self.values.add_data(hit.address, hit.rule, hit.data)
+                found.add_data(hit.address, hit.rule, hit.data)
+        # Names of the hits which are gone
+        kept = set(found.eas)
+        for ea, rule in removed:
+            current = idc.Name(ea) or ""
+            if ea not in kept and current.startswith(rule) and _NAME_SUFFIX_RE.match(current[len(rule):]):
+                idaapi.set_name(ea, "", idaapi.SN_NOWARN)
+        self.plugin.apply_names(found)
+        self.chooser.invalidate()
+        print("Findcrypt: %d patched ranges rescanned, %d hits before, %d after" % (
+            len(units), len(removed), len(found)))
+
+class YaraGroupedResultChooser(idaapi.Choose2):
+    """Results of a search, hits of a rule merged into ranges."""
+
+    def __init__(self, title, ranges, flags=0, width=None, height=None, embedded=False):
+        idaapi.Choose2.__init__(
+            self,
+            title,
+            [
+                ["Address", idaapi.Choose2.CHCOL_HEX|10],
+                ["End", idaapi.Choose2.CHCOL_HEX|10],
+                ["Name", idaapi.Choose2.CHCOL_PLAIN|40],
+                ["Hits", idaapi.Choose2.CHCOL_DEC|6],
+                ["Size", idaapi.Choose2.CHCOL_HEX|8],
+            ],
+            flags=flags,
+            width=width,
+            height=height,
+            embedded=embedded)
+        self.items = ranges
+
+    def OnClose(self):
+        return
+
+    def OnSelectLine(self, n):
+        idc.Jump(self.items[n].start)
+
+    def OnGetLine(self, n):
+        r = self.items[n]
+        return [idc.atoa(r.start), idc.atoa(r.end), r.rule, str(r.count), "%X" % (r.end - r.start)]
+
+    def OnGetSize(self):
+        return len(self.items)
+
+    def show(self):
+        return self.Show() >= 0
+
+class YaraDiffChooser(idaapi.Choose2):
+    """Hits added, removed or relocated since a previous scan."""
+
+    def __init__(self, title, changes, flags=0, width=None, height=None, embedded=False):
+        idaapi.Choose2.__init__(
+            self,
+            title,
+            [
+                ["Change", idaapi.Choose2.CHCOL_PLAIN|10],
+                ["Address", idaapi.Choose2.CHCOL_HEX|10],
+                ["Previous", idaapi.Choose2.CHCOL_HEX|10],
+                ["Name", idaapi.Choose2.CHCOL_PLAIN|40],
+                ["Value", idaapi.Choose2.CHCOL_PLAIN|32],
+            ],
+            flags=flags,
+            width=width,
+            height=height,
+            embedded=embedded)
+        self.items = changes
+
+    def OnClose(self):
+        return
+
+    def OnSelectLine(self, n):
+        change = self.items[n]
+        idc.Jump(change.old_ea if change.new_ea is None else change.new_ea)
+
+    def OnGetLine(self, n):
+        change = self.items[n]
+        return [change.kind,
+                "" if change.new_ea is None else idc.atoa(change.new_ea),
+                "" if change.old_ea is None else idc.atoa(change.old_ea),
+                change.rule,
+                repr(change.data)]
+
+    def OnGetSize(self):
+        return len(self.items)
+
+    def show(self):
+        return self.Show() >= 0
+
 #--------------------------------------------------------------------------
 # Plugin
 #--------------------------------------------------------------------------
@@ -134,6 +512,21 @@ class Findcrypt_Plugin_t(idaapi.plugin_t):
     wanted_name = "Findcrypt"
     wanted_hotkey = "Ctrl-Alt-F"
     flags = idaapi.PLUGIN_KEEP
+    scan_mode = SCAN_MODE_SNAPSHOT
+    background = None
+    watcher = None
+    grouped = False
+    group_gap = 0
+    last_values = None
+    entropy = True
+    immediates = False
+    entropy_threshold = entropymod.THRESHOLD
+    naming = NAMING_PER_RULE
+    timeout = None
+    chunk_timeout = None
+    max_hits_per_rule = None
+    shards = None
+    shard_python = None
 
 
     def init(self):
@@ -142,6 +535,12 @@ class Findcrypt_Plugin_t(idaapi.plugin_t):
         # register popup menu handlers
         try:
             Searcher.register(self, "Findcrypt")
+            ResultsViewer.register(self, "Findcrypt results")
+            GroupedResultsViewer.register(self, "Findcrypt grouped results")
+            Exporter.register(self, "Export Findcrypt hits")
+            DiffViewer.register(self, "Findcrypt diff")
+            SearchCanceller.register(self, "Cancel Findcrypt search")
+            WatchToggler.register(self, "Findcrypt watch patches")
         except:
             pass
 
@@ -155,10 +554,21 @@ class Findcrypt_Plugin_t(idaapi.plugin_t):
                 None,
                 0))
             idaapi.attach_action_to_menu("Edit/Findcrypt", "Findcrypt", idaapi.SETMENU_APP)
+            try:
+                idaapi.attach_action_to_menu("Edit/Findcrypt results", ResultsViewer.get_name(), idaapi.SETMENU_APP)
+                idaapi.attach_action_to_menu("Edit/Findcrypt grouped results", GroupedResultsViewer.get_name(), idaapi.SETMENU_APP)
+                idaapi.attach_action_to_menu("Edit/Export Findcrypt hits", Exporter.get_name(), idaapi.SETMENU_APP)
+                idaapi.attach_action_to_menu("Edit/Findcrypt diff", DiffViewer.get_name(), idaapi.SETMENU_APP)
+                idaapi.attach_action_to_menu("Edit/Cancel Findcrypt search", SearchCanceller.get_name(), idaapi.SETMENU_APP)
+                idaapi.attach_action_to_menu("Edit/Findcrypt watch patches", WatchToggler.get_name(), idaapi.SETMENU_APP)
+            except:
+                pass
             print("=" * 80)
             print("Findcrypt v{0} by David BERARD, 2017".format(VERSION))
             print("Findcrypt search shortcut key is Ctrl-Alt-F")
             print("Rules in %s" % YARARULES_CFGFILE)
+            if entropymod.numpy is None:
+                print("Install numpy to get high entropy regions in the results")
             if USRCFG:
                 print("Found user rules in %s" % USRDIR)
             else:
@@ -169,57 +579,864 @@ class Findcrypt_Plugin_t(idaapi.plugin_t):
         return idaapi.PLUGIN_KEEP
 
     def term(self):
-        pass
+        self.cancel_search(wait=True)
+        self.watch(False)
 
 
     def toVirtualAddress(self, offset, segments):
-        va_offset = 0
-        for seg in segments:
-            if seg[1] <= offset < seg[2]:
-                va_offset = seg[0] + (offset - seg[1])
+        va_offset = segments.to_ea(offset)
+        if va_offset is None:
+            return 0
         return va_offset
 
-    def search(self):
-        memory, offsets = self._get_memory()
-        filepaths = {"global":YARARULES_CFGFILE}
-        if USRCFG:
-            filepaths.update(USRCFG)
-        rules = yara.compile(filepaths=filepaths)
-        values = self.yarasearch(memory, offsets, rules)
+    def _rule_filepaths(self):
+        filepaths = rulesmod.default_filepaths()
+        selection = load_blob("S")
+        if selection:
+            filepaths = rulesmod.select_rules(
+                filepaths, selection, os.path.join(CACHEDIR, "selection"))
+        return filepaths
+
+    def select_rules(self, names=None, tags=None, meta=None, exclude=None):
+        """
+        Restrict the following searches on this database to a subset of the
+        rules, see rules.rule_selected. The selection is stored in the
+        database; call without argument to use all the rules again.
+        """
+        selection = {}
+        if names:
+            selection["names"] = list(names)
+        if tags:
+            selection["tags"] = list(tags)
+        if meta:
+            selection["meta"] = dict(meta)
+        if exclude:
+            selection["exclude"] = list(exclude)
+        save_blob("S", selection or None)
+        if selection:
+            filepaths = self._rule_filepaths()
+            count = 0
+            for path in filepaths.values():
+                with open(path) as f:
+                    count += len(rulesmod.split_rules(f.read())[1])
+            print("%d rules selected" % count)
+        else:
+            print("All rules selected")
+
+    def _budget(self):
+        if self.timeout is None and self.chunk_timeout is None and self.max_hits_per_rule is None:
+            return None
+        return scanner.ScanBudget(self.timeout, self.chunk_timeout, self.max_hits_per_rule)
+
+    def search(self, mode=None):
+        filepaths = self._rule_filepaths()
+        mode = mode or self.scan_mode
+        # Sharded mode compiles its shards in the workers
+        rules = None
+        if mode != SCAN_MODE_SHARDED:
+            rules = rulesmod.compile_rules(filepaths, CACHEDIR)
+        overlap = scanner.longest_string_length(filepaths.values())
+        budget = self._budget()
+        memory = offsets = None
+        if mode == SCAN_MODE_BACKGROUND:
+            if self.background is not None and self.background.is_alive():
+                print("A Findcrypt search is already running")
+                return
+            self.background = BackgroundSearch(self, rules, overlap, budget)
+            self.background.start()
+            return
+        tracker = self._entropy_tracker()
+        if mode == SCAN_MODE_STREAM:
+            values = self.streamsearch(rules, overlap, budget, tracker)
+        elif mode == SCAN_MODE_INCREMENTAL:
+            rules_key = rulesmod.rules_hash(filepaths)
+            values = self.incrementalsearch(rules, rules_key, overlap, budget, tracker)
+        elif mode == SCAN_MODE_CACHED:
+            rules_key = rulesmod.rules_hash(filepaths)
+            values = self.cachedsearch(rules, rules_key, overlap, budget, tracker)
+        elif mode == SCAN_MODE_MMAP:
+            values = self.mmapsearch(rules, overlap, budget, tracker)
+        elif mode == SCAN_MODE_PARALLEL:
+            memory, offsets = self._get_memory()
+            values = self.parallelsearch(memory, offsets, rules, overlap, budget)
+        elif mode == SCAN_MODE_SHARDED:
+            memory, offsets = self._get_memory()
+            values = self.shardsearch(memory, offsets, filepaths, budget)
+        else:
+            memory, offsets = self._get_memory()
+            values = self.yarasearch(memory, offsets, rules, budget, overlap)
+        if budget is not None and budget.cut_count():
+            print("Search cut short, results are partial:")
+            print(budget.summary(idc.atoa))
+        written = self.apply_names(values)
+        print("%d names written" % written)
+        if memory is not None:
+            view = memoryview(memory)
+            self._feed_entropy(tracker, offsets, lambda start, size: view[start:start + size])
+        # The results outlive the search, the snapshot does not
+        values.detach()
+        self._add_entropy_rows(values, self._entropy_rows(tracker))
+        self._add_code_constants(values)
+        self.last_values = values
+        if self.grouped:
+            self.show_grouped(values)
+            return
         c = YaraSearchResultChooser("Findcrypt results", values)
         r = c.show()
 
-    def yarasearch(self, memory, offsets, rules):
-        print ">>> start yara search"
-        values = list()
+    def _entropy_tracker(self):
+        """
+        Return the entropy.RegionTracker fed with the bytes read by a
+        search, or None if the entropy map is off or numpy is missing.
+        """
+        if not self.entropy or entropymod.numpy is None:
+            return None
+        return entropymod.RegionTracker(self.entropy_threshold)
+
+    def _tracked(self, read, tracker):
+        """Wrap read so the bytes it returns are also fed to tracker."""
+        if tracker is None:
+            return read
+
+        def tracked(ea, size):
+            data = read(ea, size)
+            tracker.feed(ea, data)
+            return data
+
+        return tracked
+
+    def _feed_entropy(self, tracker, regions, read):
+        """
+        Feed tracker with the (ea, start, end) regions of a buffer, such as
+        a snapshot SegmentMap, read with read(start, size).
+        """
+        if tracker is None:
+            return
+        for ea, start, end in regions:
+            for pos in lrange(start, end, entropymod.CHUNK_SIZE):
+                tracker.feed(ea + (pos - start), read(pos, min(entropymod.CHUNK_SIZE, end - pos)))
+            tracker.flush()
+
+    def _entropy_rows(self, tracker):
+        """Return (ea, end, entropy, first bytes) for the regions tracker found."""
+        if tracker is None:
+            return []
+        return tracker.finish()
+
+    def _add_entropy_rows(self, values, rows):
+        for ea, end, entropy, preview in rows:
+            values.add_data(ea, ENTROPY_RULE, preview)
+            print("High entropy: %s-%s, 0x%X bytes, %.2f bits/byte" % (
+                idc.atoa(ea), idc.atoa(end), end - ea, entropy))
+
+    def _instructions(self, func_ea):
+        """Yield (ea, mnemonic, operands) for immediates.iter_function_constants."""
+        for ea in idautils.FuncItems(func_ea):
+            operands = []
+            for n in range(MAX_OPERANDS):
+                op_type = idc.GetOpType(ea, n)
+                if op_type <= 0:
+                    break
+                if op_type == idc.o_reg:
+                    operands.append((immediates.REG, idc.GetOpnd(ea, n)))
+                elif op_type == idc.o_imm:
+                    value = idc.GetOperandValue(ea, n) & 0xFFFFFFFFFFFFFFFF
+                    if value >> 32 == 0xFFFFFFFF:
+                        # 32 bit operand sign extended
+                        value &= 0xFFFFFFFF
+                    operands.append((immediates.IMM, value))
+            yield ea, idc.GetMnem(ea), operands
+
+    def code_constants(self):
+        """
+        Return an immediates.ConstantIndex of the immediates of every
+        function, halves loaded by two instructions put back together.
+        """
+        pairs = []
+        for func_ea in idautils.Functions():
+            pairs.extend(immediates.iter_function_constants(self._instructions(func_ea)))
+        return immediates.ConstantIndex(pairs)
+
+    def _add_code_constants(self, values):
+        """
+        If the immediates attribute is set, add the instructions using a 4
+        or 8 byte constant of the rules to values.
+        """
+        if not self.immediates:
+            return
+        constants = immediates.rule_constants(self._rule_filepaths())
+        index = self.code_constants()
+        count = 0
+        for ea, constant in index.match(constants):
+            values.add_data(ea, constant.rule + CODE_CONSTANT_SUFFIX, constant.data)
+            count += 1
+        print("%d rule constants used by instructions (%d immediates indexed)" % (count, len(index)))
+
+    def show_grouped(self, values=None):
+        """
+        Show the hits of values, the last search or the stored results
+        merged in ranges: hits of a rule overlapping or at most group_gap
+        bytes apart are one row. The number of hits, ranges and bytes
+        covered by each rule are printed.
+        """
+        if values is None:
+            values = self.last_values
+        if values is None:
+            state = load_results()
+            if state is None:
+                print("No Findcrypt results to group, run a search first")
+                return
+            values = stored_values(state)
+        ranges = aggregate.aggregate(values.iter_spans(), self.group_gap)
+        for s in aggregate.summarize(ranges):
+            print("%-40s %6d hits in %5d ranges, %8d bytes, %s-%s" % (
+                s.rule, s.hits, s.ranges, s.coverage, idc.atoa(s.first), idc.atoa(s.last)))
+        c = YaraGroupedResultChooser("Findcrypt grouped results", ranges)
+        c.show()
+
+    def export(self, path=None, fmt=None):
+        """
+        Stream search writing every hit to path as soon as its chunk is
+        scanned, as JSON Lines or CSV (fmt, by default from the extension
+        of path). Hits are neither kept nor named. Ask for the file if path
+        is not given; return the number of hits written.
+        """
+        if path is None:
+            path = idc.AskFile(1, "*.jsonl;*.csv", "Export Findcrypt hits")
+            if not path:
+                return 0
+        filepaths = self._rule_filepaths()
+        budget = self._budget()
+        print(">>> start yara export to %s" % path)
+        hits = self._iter_stream_hits(filepaths, budget)
+        with exportmod.open_output(path) as output:
+            count = exportmod.write_hits(hits, output, fmt or exportmod.format_for(path),
+                                         exportmod.rule_meta(filepaths), idc.SegName)
+        print("<<< end yara export, %d hits written" % count)
+        if budget is not None and budget.cut_count():
+            print("Export cut short, results are partial:")
+            print(budget.summary(idc.atoa))
+        return count
+
+    def _iter_stream_hits(self, filepaths, budget=None):
+        """
+        Yield the hits of a stream search with the rules of filepaths,
+        chunked as export and incremental searches do.
+        """
+        rules = rulesmod.compile_rules(filepaths, CACHEDIR)
+        overlap = scanner.longest_string_length(filepaths.values())
+        buf = bytearray(scanner.CHUNK_SIZE + overlap + 1)
+
+        def read(ea, size):
+            self._copy_bytes(buf, 0, ea, size)
+            return memoryview(buf)[:size]
+
+        return scanner.iter_stream_hits(rules, self._segments(), read, overlap=overlap, budget=budget)
+
+    def diff(self, previous=None):
+        """
+        Stream search again and compare the hits with previous ones: those
+        of the export or batch output at path previous, else those stored
+        in this database by the last incremental search. Hits are matched
+        by rule and bytes; added, removed and relocated hits are shown and
+        the Diff is returned. The new hits are neither kept nor named.
+        """
+        if previous is None:
+            state = load_results()
+            if state is None:
+                print("No stored Findcrypt results, give a previous export")
+                return None
+            old = list(stored_values(state))
+        else:
+            old, skipped = diffmod.load_export(previous)
+            if skipped:
+                print("%d hits of %s without address left out" % (skipped, previous))
+        budget = self._budget()
+        new = ((hit.address, hit.rule, hit.data)
+               for hit in self._iter_stream_hits(self._rule_filepaths(), budget))
+        result = diffmod.diff_hits(old, new)
+        if budget is not None and budget.cut_count():
+            print("Search cut short, the diff is partial:")
+            print(budget.summary(idc.atoa))
+        counts = diffmod.count_changes(result.changes)
+        print("Findcrypt diff: %d added, %d removed, %d relocated, %d unchanged" % (
+            counts[diffmod.ADDED], counts[diffmod.REMOVED], counts[diffmod.RELOCATED],
+            result.unchanged))
+        c = YaraDiffChooser("Findcrypt diff", result.changes)
+        c.show()
+        return result
+
+    def watch(self, enable=True):
+        """
+        Start or stop the watch mode: while it runs, patched bytes are
+        rescanned every WATCH_INTERVAL ms, starting from the results of the
+        last search (a search is run first if there are none).
+        """
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+            print("Findcrypt watch mode stopped")
+        if not enable:
+            return
+        if self.last_values is None:
+            self.search(SCAN_MODE_SNAPSHOT if self.scan_mode == SCAN_MODE_BACKGROUND else None)
+        filepaths = self._rule_filepaths()
+        overlap = scanner.longest_string_length(filepaths.values())
+        self.watcher = PatchWatcher(self, rulesmod.compile_rules(filepaths, CACHEDIR), overlap, self.last_values)
+        print("Findcrypt watch mode started, patched bytes are rescanned")
+
+    def cancel_search(self, wait=False):
+        """
+        Stop the background search, if one is running. With wait, it is
+        stopped without showing its results and its thread is joined.
+        """
+        if self.background is not None and self.background.is_alive():
+            if wait:
+                self.background.stop()
+            else:
+                self.background.cancelled.set()
+
+    def apply_names(self, values, policy=None):
+        """
+        Name the addresses of the hits after their rule, in one batch once
+        the search is done. With the NAMING_FIRST policy only the first hit
+        of each rule is named, with NAMING_PER_RULE every hit address is
+        named after the first rule matching there, NAMING_NONE writes no
+        names. Addresses already named after their rule (with or without a
+        numeric suffix) are left alone. Return the number of names written.
+        """
+        policy = policy or self.naming
+        if policy == NAMING_NONE:
+            return 0
+        names = {}
+        named_rules = set()
+        for n in range(len(values)):
+            ea, rule = values.ea(n), values.rule(n)
+            if ea in names:
+                continue
+            if policy == NAMING_FIRST:
+                if rule in named_rules:
+                    continue
+                named_rules.add(rule)
+            names[ea] = rule
+
+        # Keep the auto analysis from running and refreshing the views
+        # between two renames
+        enable_auto = getattr(idaapi, "enable_auto", None)
+        auto_enabled = enable_auto(False) if enable_auto else None
+        written = 0
+        try:
+            for ea in sorted(names):
+                name = names[ea]
+                current = idc.Name(ea) or ""
+                if current.startswith(name) and _NAME_SUFFIX_RE.match(current[len(name):]):
+                    continue
+                if idaapi.set_name(ea, name, idaapi.SN_FORCE | idaapi.SN_NOWARN):
+                    written += 1
+        finally:
+            if enable_auto:
+                enable_auto(auto_enabled)
+            idaapi.refresh_idaview_anyway()
+        return written
+
+    def yarasearch(self, memory, offsets, rules, budget=None, overlap=0):
+        """
+        Match the whole snapshot at once. With timeouts in budget, the
+        snapshot is matched in chunks instead so what was scanned before a
+        timeout is kept.
+        """
+        print(">>> start yara search")
+        if budget is not None and (budget.timeout or budget.chunk_timeout):
+            view = memoryview(memory)
+            ranges = [(start, end) for ea, start, end in offsets]
+            hits = scanner.iter_stream_hits(
+                rules, ranges, lambda start, size: view[start:start + size],
+                overlap=overlap, budget=budget)
+            values = self._snapshot_values(memory, offsets, hits, budget)
+            print("<<< end yara search")
+            return values
+        values = ResultStore(memory)
         matches = rules.match(data=memory)
         for match in matches:
             name = match.rule
             #print "%s => %d matches" % (name, len(match.strings))
-            for string in match.strings:
-                # print "\t 0x%08x : %s" % (self.toVirtualAddress(string[0],offsets),repr(string[2]))
-                value = [
-                    self.toVirtualAddress(string[0], offsets),
-                    name,
-                    repr(string[2]),
-                ]
-                idaapi.set_name(value[0], name, idaapi.SN_FORCE)
-                values.append(value)
-        print "<<< end yara search"
+            strings = list(scanner.iter_match_strings(match))
+            eas = offsets.to_eas([string[0] for string in strings])
+            for ea, (offset, identifier, data) in zip(eas, strings):
+                # print "\t 0x%08x : %s" % (ea, repr(data))
+                if budget is not None and not budget.accept(scanner.Hit(offset, name, identifier, data)):
+                    continue
+                values.add(ea if ea is not None else 0, name, offset, len(data))
+        print("<<< end yara search")
+        return values
+
+    def _snapshot_values(self, memory, offsets, hits, budget):
+        """
+        Return a ResultStore of hits found in the snapshot. The ranges
+        skipped by budget are translated from snapshot offsets to addresses.
+        """
+        hits = list(hits)
+        eas = offsets.to_eas([hit.address for hit in hits])
+        values = ResultStore(memory)
+        for ea, hit in zip(eas, hits):
+            if ea is None:
+                continue
+            values.add(ea, hit.rule, hit.address, len(hit.data))
+        if budget is not None:
+            budget.skipped = [(offsets.to_ea(start), offsets.to_ea(end - 1) + 1, reason)
+                              for start, end, reason in budget.skipped]
         return values
 
+    def streamsearch(self, rules, overlap, budget=None, tracker=None):
+        """
+        Scan segment by segment, large segments in overlapping chunks, with
+        a single chunk buffer reused for every read. Rules whose condition
+        needs several strings only match if these strings are in the same
+        chunk.
+        """
+        print(">>> start yara stream search")
+        values = ResultStore()
+        buf = bytearray(scanner.CHUNK_SIZE + overlap + 1)
+
+        def read(ea, size):
+            self._copy_bytes(buf, 0, ea, size)
+            return memoryview(buf)[:size]
+
+        read = self._tracked(read, tracker)
+        ranges = self._segments()
+        for hit in scanner.iter_stream_hits(rules, ranges, read, overlap=overlap, budget=budget):
+            values.add_data(hit.address, hit.rule, hit.data)
+        print("<<< end yara stream search")
+        return values
+
+    def parallelsearch(self, memory, offsets, rules, overlap, budget=None):
+        """
+        Match the snapshot on a thread pool, each segment split in chunks.
+        As in stream mode, multi-string rules need their strings to be in
+        the same chunk.
+        """
+        print(">>> start yara parallel search")
+        view = memoryview(memory)
+        ranges = [(start, end) for ea, start, end in offsets]
+        hits = scanner.iter_parallel_hits(
+            rules, ranges, lambda start, size: view[start:start + size],
+            overlap=overlap, budget=budget)
+        values = self._snapshot_values(memory, offsets, hits, budget)
+        print("<<< end yara parallel search")
+        return values
+
+    def shardsearch(self, memory, offsets, filepaths, budget=None):
+        """
+        Match the whole snapshot in worker processes, each with a shard of
+        the rules, and merge their hits. Unlike the chunked modes, results
+        are the same as in the default mode.
+        """
+        print(">>> start yara sharded search")
+        shards = shard.shard_rules(filepaths, self.shards or scanner.default_workers(),
+                                   os.path.join(CACHEDIR, "shards"))
+        hits = shard.iter_sharded_hits(memory, shards, self.shard_python, budget)
+        values = self._snapshot_values(memory, offsets, hits, budget)
+        print("<<< end yara sharded search")
+        return values
+
+    def incrementalsearch(self, rules, rules_key, overlap, budget=None, tracker=None):
+        """
+        Stream search which only rescans the segments whose content changed
+        since the last incremental search, or all of them if the rules
+        changed. Hits of unchanged segments are taken from the database,
+        along with a hash of each segment. Segments cut short by budget are
+        stored without hash so the next search scans them again.
+        """
+        print(">>> start yara incremental search")
+        state = load_results()
+        previous = {}
+        if state is not None and state["rules"] == rules_key:
+            for seg in state["segments"]:
+                previous[(seg["start"], seg["end"])] = seg
+        buf = bytearray(scanner.CHUNK_SIZE + overlap + 1)
+
+        def read(ea, size):
+            self._copy_bytes(buf, 0, ea, size)
+            return memoryview(buf)[:size]
+
+        # Every byte is read for the fingerprints, entropy is measured there
+        tracked = self._tracked(read, tracker)
+        segments = []
+        rescanned = 0
+        for start, end in self._segments():
+            fingerprint = hashlib.sha1()
+            for ea in lrange(start, end, scanner.CHUNK_SIZE):
+                fingerprint.update(tracked(ea, min(scanner.CHUNK_SIZE, end - ea)))
+            fingerprint = fingerprint.hexdigest()
+            seg = previous.get((start, end))
+            if seg is None or seg["hash"] != fingerprint:
+                hits = []
+                cut_count = budget.cut_count() if budget is not None else 0
+                for hit in scanner.iter_stream_hits(rules, [(start, end)], read,
+                                                    overlap=overlap, budget=budget):
+                    hits.append([hit.address, hit.rule, hit.identifier,
+                                 binascii.hexlify(hit.data).decode("ascii")])
+                if budget is not None and budget.cut_count() != cut_count:
+                    fingerprint = None
+                seg = {"start": start, "end": end, "hash": fingerprint, "hits": hits}
+                rescanned += 1
+            segments.append(seg)
+        state = {"rules": rules_key, "segments": segments}
+        save_results(state)
+        print("%d of %d segments rescanned" % (rescanned, len(segments)))
+        print("<<< end yara incremental search")
+        return stored_values(state)
+
+    def cachedsearch(self, rules, rules_key, overlap, budget=None, tracker=None):
+        """
+        Stream search in the content defined blocks of hitcache. The hits
+        of every block are kept in a SQLite cache shared by all databases,
+        keyed by the hash of the block content and of the rules: blocks
+        already matched anywhere are not matched again. Multi-string rules
+        need their strings to be in the same block.
+        """
+        print(">>> start yara cached search")
+        if not os.path.exists(CACHEDIR):
+            os.makedirs(CACHEDIR)
+        cache = hitcache.HitCache(HIT_CACHE_FILE, rules_key)
+        values = ResultStore()
+        buf = bytearray(hitcache.PIECE_SIZE + overlap + 1)
+
+        def read(ea, size):
+            self._copy_bytes(buf, 0, ea, size)
+            return memoryview(buf)[:size]
+
+        read = self._tracked(read, tracker)
+        try:
+            for hit in hitcache.iter_cached_hits(rules, self._segments(), read, cache,
+                                                 overlap=overlap, budget=budget):
+                values.add_data(hit.address, hit.rule, hit.data)
+        finally:
+            cache.close()
+        print("%d blocks matched, %d taken from the cache" % (cache.misses, cache.hits))
+        print("<<< end yara cached search")
+        return values
+
+    def _file_regions(self, start, end):
+        """
+        Return (ea, file offset, size) for the parts of [start, end) loaded
+        from the input file. A range is taken as mapped linearly when both
+        its ends are, otherwise it is split in halves; small ranges which
+        are not linear are left out. Bytes without file backing at the start
+        of a range are skipped up to the next backed address.
+        """
+        offset = idaapi.get_fileregion_offset(start)
+        if offset == -1 and end - start > SNAPSHOT_MIN_BLOCK_SIZE:
+            start = self._next_backed(start, end)
+            if start >= end:
+                return []
+            offset = idaapi.get_fileregion_offset(start)
+        last = idaapi.get_fileregion_offset(end - 1)
+        if offset != -1 and last == offset + (end - 1 - start):
+            return [(start, offset, end - start)]
+        if end - start <= SNAPSHOT_MIN_BLOCK_SIZE:
+            return []
+        middle = start + (end - start) // 2
+        regions = self._file_regions(start, middle)
+        for region in self._file_regions(middle, end):
+            if regions and regions[-1][0] + regions[-1][2] == region[0] \
+                    and regions[-1][1] + regions[-1][2] == region[1]:
+                regions[-1] = (regions[-1][0], regions[-1][1], regions[-1][2] + region[2])
+            else:
+                regions.append(region)
+        return regions
+
+    def _next_backed(self, start, end):
+        """
+        Return an address of (start, end] close after the end of the bytes
+        without file backing at start: probes at doubling distances find a
+        backed address, then a binary search the transition, to within
+        SNAPSHOT_MIN_BLOCK_SIZE. Backed bytes between two probes are missed,
+        the caller scans them from the database.
+        """
+        lo = start
+        step = SNAPSHOT_MIN_BLOCK_SIZE
+        while True:
+            hi = min(end - 1, lo + step)
+            if hi <= lo:
+                return end
+            if idaapi.get_fileregion_offset(hi) != -1:
+                break
+            lo = hi
+            step *= 2
+        while hi - lo > SNAPSHOT_MIN_BLOCK_SIZE:
+            middle = lo + (hi - lo) // 2
+            if idaapi.get_fileregion_offset(middle) != -1:
+                hi = middle
+            else:
+                lo = middle
+        return hi
+
+    def _patched_ranges(self, segments, overlap):
+        """
+        Return the sorted, merged ranges where a match may include a patched
+        byte: overlap bytes before each patched byte, within its segment.
+        """
+        patched = []
+
+        def visitor(ea, fpos, org_val, patch_val):
+            patched.append(ea)
+            return 0
+
+        idaapi.visit_patched_bytes(0, idaapi.BADADDR, visitor)
+        starts = [start for start, end in segments]
+        ranges = []
+        for ea in sorted(patched):
+            i = bisect.bisect_right(starts, ea) - 1
+            if i < 0 or ea >= segments[i][1]:
+                continue
+            start = max(segments[i][0], ea - overlap)
+            if ranges and start <= ranges[-1][1] and ranges[-1][0] >= segments[i][0]:
+                ranges[-1] = (ranges[-1][0], ea + 1)
+            else:
+                ranges.append((start, ea + 1))
+        return ranges
+
+    def mmapsearch(self, rules, overlap, budget=None, tracker=None):
+        """
+        Match the input file mapped in memory instead of a copy of the
+        database, and translate file offsets to addresses with the file
+        regions of the database. Bytes with no file backing and the
+        neighbourhood of patched bytes are matched from the database, so
+        multi-string rules only match if their strings are all in the file
+        or all in one of these ranges. Entropy is measured on the file bytes
+        too, patched or not. Falls back to the default mode if the input
+        file is missing.
+        """
+        path = idaapi.get_input_file_path()
+        if not path or not os.path.isfile(path) or not os.path.getsize(path):
+            print("Input file %s not found, scanning the database" % path)
+            memory, offsets = self._get_memory()
+            view = memoryview(memory)
+            self._feed_entropy(tracker, offsets, lambda start, size: view[start:start + size])
+            return self.yarasearch(memory, offsets, rules, budget, overlap)
+
+        print(">>> start yara mmap search")
+        segments = self._segments()
+        regions = []
+        db_ranges = []
+        for start, end in segments:
+            pos = start
+            for ea, offset, size in self._file_regions(start, end):
+                if ea > pos:
+                    db_ranges.append((pos, ea))
+                regions.append((offset, size, ea))
+                pos = ea + size
+            if pos < end:
+                db_ranges.append((pos, end))
+        file_map = SegmentMap()
+        last_end = 0
+        for offset, size, ea in sorted(regions):
+            # File bytes loaded twice are only matched from the file for the
+            # first region, the other copies are scanned from the database
+            start = max(offset, last_end)
+            if start > offset:
+                db_ranges.append((ea, ea + min(start, offset + size) - offset))
+            if start < offset + size:
+                file_map.add(ea + (start - offset), start, offset + size)
+                last_end = offset + size
+        merged = []
+        for start, end in sorted(db_ranges):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        db_ranges = merged
+        patched = self._patched_ranges(segments, overlap)
+        patched_starts = [start for start, end in patched]
+        db_starts = [start for start, end in db_ranges]
+
+        def in_ranges(ea, starts, ranges):
+            i = bisect.bisect_right(starts, ea) - 1
+            return i >= 0 and ea < ranges[i][1]
+
+        values = ResultStore()
+        if budget is not None:
+            budget.start()
+        with open(path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                timeout = budget.match_timeout() if budget is not None else None
+                try:
+                    if timeout is None:
+                        matches = rules.match(data=data)
+                    else:
+                        matches = rules.match(data=data, timeout=timeout)
+                except yara.TimeoutError:
+                    budget.skip(segments[0][0], segments[-1][1], "timeout")
+                    matches = []
+                self._feed_entropy(tracker, file_map, lambda start, size: data[start:start + size])
+            finally:
+                data.close()
+        for match in matches:
+            strings = list(scanner.iter_match_strings(match))
+            eas = file_map.to_eas([string[0] for string in strings])
+            for ea, (offset, identifier, string) in zip(eas, strings):
+                # Matches crossing two file regions are not in the database
+                if ea is None or file_map.find(offset) != file_map.find(offset + len(string) - 1):
+                    continue
+                if in_ranges(ea, patched_starts, patched):
+                    continue
+                if budget is None or budget.accept(scanner.Hit(ea, match.rule, identifier, string)):
+                    values.add_data(ea, match.rule, string)
+
+        buf = bytearray(scanner.CHUNK_SIZE + overlap + 1)
+
+        def read(ea, size):
+            self._copy_bytes(buf, 0, ea, size)
+            return memoryview(buf)[:size]
+
+        for hit in scanner.iter_stream_hits(rules, db_ranges, self._tracked(read, tracker),
+                                            overlap=overlap, budget=budget):
+            values.add_data(hit.address, hit.rule, hit.data)
+        seg_ends = [end for start, end in segments]
+        for start, end in patched:
+            # Rescan each patched range from the database with the bytes
+            # following it, only keeping the matches starting in the range
+            seg_end = seg_ends[bisect.bisect_right(seg_ends, start)]
+            for hit in scanner.iter_stream_hits(rules, [(start, min(seg_end, end + overlap))],
+                                                read, overlap=overlap):
+                if hit.address >= end or in_ranges(hit.address, db_starts, db_ranges):
+                    continue
+                if budget is None or budget.accept(hit):
+                    values.add_data(hit.address, hit.rule, hit.data)
+        print("%d bytes matched from %s, %d ranges from the database" % (
+            sum(end - offset for ea, offset, end in file_map), path,
+            len(db_ranges) + len(patched)))
+        print("<<< end yara mmap search")
+        return values
+
+    def profile(self, budget=None, output_dir=None, repeat=1):
+        """
+        Time every rule alone against the current database and print them
+        ranked by matching time, with the total per rule file. If budget
+        (in seconds) is given, a copy of the rule files without the rules
+        slower than budget is written to output_dir (USRDIR/pruned by
+        default). Return the profile.
+        """
+        memory, offsets = self._get_memory()
+        filepaths = self._rule_filepaths()
+        profile = rulesmod.profile_rules(filepaths, memory, repeat)
+        print(rulesmod.format_profile(profile))
+        if budget is not None:
+            output_dir = output_dir or os.path.join(USRDIR, "pruned")
+            pruned = rulesmod.prune_rules(filepaths, profile, budget, output_dir)
+            slow = [entry for entry in profile if entry["time"] is not None and entry["time"] > budget]
+            print("%d rules slower than %gs pruned, rules written to:" % (len(slow), budget))
+            for namespace in sorted(pruned):
+                print("  %s" % pruned[namespace])
+        return profile
+
+    def show_results(self):
+        state = load_results()
+        if state is None:
+            print("No stored Findcrypt results, run an incremental search first")
+            return
+        c = YaraSearchResultChooser("Findcrypt results", stored_values(state))
+        c.show()
+
+    def set_segment_filter(self, **kwargs):
+        """
+        Change the segment filter of this database, stored in the database.
+        Keys are those of DEFAULT_SEGMENT_FILTER; call without argument to
+        go back to the defaults.
+        """
+        for key in kwargs:
+            if key not in DEFAULT_SEGMENT_FILTER:
+                raise ValueError("unknown segment filter option: %s" % key)
+        seg_filter = load_blob("F") or {}
+        seg_filter.update(kwargs)
+        save_blob("F", seg_filter if kwargs else None)
+
+    def _segment_filter(self):
+        seg_filter = dict(DEFAULT_SEGMENT_FILTER)
+        seg_filter.update(load_blob("F") or {})
+        return seg_filter
+
+    def _segments(self):
+        """
+        Return the (start, end) ranges to scan: segments rejected by the
+        segment filter are skipped and, when loaded bytes are required, the
+        unloaded bytes at both ends of a segment are left out.
+        """
+        seg_filter = self._segment_filter()
+        skip_classes = set(seg_filter["skip_classes"])
+        skip_types = set(getattr(idaapi, name) for name in seg_filter["skip_types"])
+        ranges = []
+        skipped = 0
+        for start in idautils.Segments():
+            end = idc.SegEnd(start)
+            seg = idaapi.getseg(start)
+            if seg.type in skip_types or idaapi.get_segm_class(seg) in skip_classes:
+                skipped += 1
+                continue
+            if seg_filter["readable_only"] and seg.perm and not seg.perm & idaapi.SEGPERM_READ:
+                skipped += 1
+                continue
+            if seg_filter["loaded_only"]:
+                if not idc.isLoaded(start):
+                    start = idaapi.next_that(start, end, idaapi.has_value)
+                    if start == idaapi.BADADDR or start >= end:
+                        skipped += 1
+                        continue
+                if not idc.isLoaded(end - 1):
+                    end = idaapi.prev_that(end, start, idaapi.has_value) + 1
+            if seg_filter["max_size"] and end - start > seg_filter["max_size"]:
+                skipped += 1
+                continue
+            ranges.append((start, end))
+        if skipped:
+            print("%d segments skipped by the segment filter" % skipped)
+        return ranges
+
     def _get_memory(self):
-        result = ""
-        segment_starts = [ea for ea in idautils.Segments()]
-        offsets = []
+        segments = self._segments()
+        total = 0
+        for start, end in segments:
+            total += end - start
+        result = bytearray(total)
+        offsets = SegmentMap()
         start_len = 0
-        for start in segment_starts:
-            end = idc.SegEnd(start)
-            for ea in lrange(start, end):
-                result += chr(idc.Byte(ea))
-            offsets.append((start, start_len, len(result)))
-            start_len = len(result)
+        for start, end in segments:
+            pos = start_len
+            for ea in lrange(start, end, SNAPSHOT_BLOCK_SIZE):
+                size = min(SNAPSHOT_BLOCK_SIZE, end - ea)
+                self._copy_bytes(result, pos, ea, size)
+                pos += size
+            offsets.add(start, start_len, pos)
+            start_len = pos
         return result, offsets
 
+    def _copy_bytes(self, buf, pos, ea, size):
+        """
+        Copy size bytes at ea into buf[pos:]. GetManyBytes fails as soon as
+        one byte of the range is not loaded. A range starting with unloaded
+        bytes has them filled with 0xFF, as idc.Byte reads them, up to the
+        next loaded byte; other ranges are split until they are small enough
+        to be read byte per byte.
+        """
+        data = idc.GetManyBytes(ea, size)
+        if data is not None:
+            buf[pos:pos + size] = data
+        elif not idc.isLoaded(ea):
+            end = idaapi.next_that(ea, ea + size, idaapi.has_value)
+            if end == idaapi.BADADDR or end > ea + size:
+                end = ea + size
+            buf[pos:pos + end - ea] = b"\xff" * (end - ea)
+            if end < ea + size:
+                self._copy_bytes(buf, pos + end - ea, end, ea + size - end)
+        elif size > SNAPSHOT_MIN_BLOCK_SIZE:
+            half = size // 2
+            self._copy_bytes(buf, pos, ea, half)
+            self._copy_bytes(buf, pos + half, ea + half, size - half)
+        else:
+            for i in range(size):
+                buf[pos + i] = idc.Byte(ea + i) & 0xFF
+
     def run(self, arg):
         self.search()
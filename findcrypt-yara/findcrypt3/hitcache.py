@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+#
+# Content-addressed cache of search hits shared by all databases. Ranges are
+# scanned in blocks cut where the content says so; the hits of a block are
+# stored in SQLite under a hash of the bytes it was matched with and the
+# ruleset, so a block already seen in any database, at any address, is not
+# matched again. Content defined blocks need numpy, without it blocks are cut
+# every BLOCK_SIZE bytes and only match at the same offset modulo BLOCK_SIZE.
+
+import binascii
+import hashlib
+import json
+import sqlite3
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from . import scanner
+
+BLOCK_SIZE = 0x10000
+
+# Blocks end after the 4 bytes windows whose hash is CUT_MAGIC, but are at
+# least MIN_BLOCK_SIZE and at most MAX_BLOCK_SIZE bytes long: 72 KB on
+# average. No run of one repeated byte or byte pair hashes to CUT_MAGIC.
+MIN_BLOCK_SIZE = 0x2000
+MAX_BLOCK_SIZE = 0x40000
+CUT_MULTIPLIER = 0x9E3779B1
+CUT_MAGIC = 0xCD00
+
+# Bytes read and cut into blocks at once. Pieces end on the last cut found
+# in them, so they do not move the cuts of the following bytes.
+PIECE_SIZE = 0x400000
+
+
+class HitCache(object):
+    """
+    SQLite table of the hits of blocks, keyed by (ruleset, digest). hits
+    counts the blocks found in the cache since it was opened, misses the
+    blocks matched and added to it.
+    """
+
+    def __init__(self, path, ruleset):
+        self.ruleset = ruleset
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute("CREATE TABLE IF NOT EXISTS blocks ("
+                        "ruleset TEXT NOT NULL, digest TEXT NOT NULL, hits TEXT NOT NULL, "
+                        "PRIMARY KEY (ruleset, digest))")
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest):
+        """Return the hits stored for digest, a list of Hits, or None."""
+        row = self.db.execute("SELECT hits FROM blocks WHERE ruleset = ? AND digest = ?",
+                              (self.ruleset, digest)).fetchone()
+        if row is None:
+            return None
+        self.hits += 1
+        return [scanner.Hit(address, rule, identifier, binascii.unhexlify(data))
+                for address, rule, identifier, data in json.loads(row[0])]
+
+    def put(self, digest, hits):
+        hits = [[hit.address, hit.rule, hit.identifier, binascii.hexlify(hit.data).decode("ascii")]
+                for hit in hits]
+        self.db.execute("INSERT OR REPLACE INTO blocks (ruleset, digest, hits) VALUES (?, ?, ?)",
+                        (self.ruleset, digest, json.dumps(hits)))
+        self.misses += 1
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+def block_digest(data, own_offset, own_size):
+    """
+    Hash of a block window: its bytes and where the owned part is in it, as
+    the same bytes give different hits when split differently.
+    """
+    h = hashlib.sha1(struct.pack("<QQ", own_offset, own_size))
+    h.update(data)
+    return h.hexdigest()
+
+
+def block_cuts(data, min_size=MIN_BLOCK_SIZE, max_size=MAX_BLOCK_SIZE):
+    """
+    Return the offsets where the blocks of data end, the last one being
+    len(data). Cuts only depend on the bytes around them, so the same bytes
+    are cut the same way wherever they are. Without numpy, blocks are cut
+    every BLOCK_SIZE bytes.
+    """
+    size = len(data)
+    if numpy is None:
+        return list(range(BLOCK_SIZE, size, BLOCK_SIZE)) + [size]
+    candidates = numpy.zeros(0, dtype=numpy.int64)
+    if size >= 4:
+        buf = numpy.frombuffer(data, dtype=numpy.uint8)
+        words = buf[:-3].astype(numpy.uint32)
+        for k in range(1, 4):
+            words |= buf[k:size - 3 + k].astype(numpy.uint32) << (8 * k)
+        words *= numpy.uint32(CUT_MULTIPLIER)
+        candidates = numpy.flatnonzero((words >> 16) == CUT_MAGIC) + 4
+    cuts = []
+    last = 0
+    while size - last > min_size:
+        i = numpy.searchsorted(candidates, last + min_size)
+        if i < len(candidates) and candidates[i] <= last + max_size:
+            cut = int(candidates[i])
+        else:
+            cut = last + max_size
+        if cut >= size:
+            break
+        cuts.append(cut)
+        last = cut
+    cuts.append(size)
+    return cuts
+
+
+def iter_cached_hits(rules, ranges, read, cache, overlap=0, budget=None):
+    """
+    Same as scanner.iter_stream_hits, but ranges are matched in the blocks
+    of block_cuts and the hits of a block are taken from cache when its
+    window was already matched with the same rules. read is called with
+    pieces of up to PIECE_SIZE + overlap + 1 bytes. Hits are stored
+    relative to the window; blocks cut short by budget are not stored.
+    """
+    if budget is not None:
+        budget.start()
+    for start, end in ranges:
+        pos = start
+        while pos < end:
+            size = min(PIECE_SIZE, end - pos)
+            piece_start = max(start, pos - 1)
+            piece = read(piece_start, min(end, pos + size + overlap) - piece_start)
+            cuts = block_cuts(memoryview(piece)[pos - piece_start:pos - piece_start + size])
+            if pos + size < end and len(cuts) > 1:
+                # The last block ends with the piece, not on a cut
+                cuts.pop()
+            own_start = pos
+            for cut in cuts:
+                own_end = pos + cut
+                win_start = max(start, own_start - 1)
+                win_end = min(end, own_end + overlap)
+                data = piece[win_start - piece_start:win_end - piece_start]
+                unit = (own_start, own_end, win_start, win_end)
+                for hit in _block_hits(rules, cache, data, unit, budget) or []:
+                    if budget is None or budget.accept(hit):
+                        yield hit
+                own_start = own_end
+            pos = own_start
+
+
+def _block_hits(rules, cache, data, unit, budget):
+    """Hits of one block, from the cache or matched and stored."""
+    own_start, own_end, win_start, win_end = unit
+    digest = block_digest(data, own_start - win_start, own_end - own_start)
+    hits = cache.get(digest)
+    if hits is not None:
+        return [hit._replace(address=hit.address + win_start) for hit in hits]
+    hits = scanner._scan_unit(rules, lambda address, size: data, unit, budget)
+    if hits is not None:
+        cache.put(digest, [hit._replace(address=hit.address - win_start) for hit in hits])
+    return hits
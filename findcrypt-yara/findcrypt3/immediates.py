@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+#
+# Index of the constants loaded by instructions, for crypto constants which
+# are built in registers instead of stored as data. Values split in two
+# instructions are put back together: movw/movt on ARM, lui/ori and
+# lui/addiu on MIPS, lis/ori and lis/addi on PowerPC.
+
+import bisect
+import binascii
+import collections
+import re
+
+from .rules import split_rules
+from .segmap import new_array
+
+REG, IMM = "reg", "imm"
+
+# Smaller values are too common in code to be told apart from constants.
+MIN_VALUE = 0x10000
+
+_LOW_HALF = ("movw",)
+_HIGH_HALF = ("movt",)
+_HIGH_FIRST = ("lui", "lis")
+_OR_LOW = ("ori",)
+_ADD_LOW = ("addiu", "addi")
+
+_HEX_STRING_RE = re.compile(r'(\$\w*)\s*=\s*\{([0-9a-fA-F\s]+)\}')
+
+Constant = collections.namedtuple("Constant", ["rule", "identifier", "data"])
+
+
+def iter_function_constants(instructions):
+    """
+    Yield (ea, value) for the immediates of the instructions of a function,
+    given as (ea, mnemonic, operands) with operands a list of (REG, name) or
+    (IMM, value), in address order. A register half loaded by one
+    instruction is completed by a later one using the same register, as
+    long as no other instruction writes it first.
+    """
+    pending = {}
+    for ea, mnem, operands in instructions:
+        mnem = mnem.lower()
+        regs = [value for kind, value in operands if kind == REG]
+        imms = [value for kind, value in operands if kind == IMM]
+        for value in imms:
+            yield ea, value
+        if not regs:
+            continue
+        dest = regs[0]
+        half = pending.pop(dest, None)
+        if not imms:
+            continue
+        imm = imms[0] & 0xFFFF
+        if mnem in _LOW_HALF:
+            pending[dest] = ("low", imm)
+        elif mnem in _HIGH_FIRST:
+            pending[dest] = ("high", imm)
+        elif mnem in _HIGH_HALF:
+            if half is not None and half[0] == "low":
+                yield ea, imm << 16 | half[1]
+        elif mnem in _OR_LOW + _ADD_LOW:
+            source = regs[1] if len(regs) > 1 else dest
+            if source != dest:
+                half = pending.get(source)
+            if half is not None and half[0] == "high":
+                if mnem in _OR_LOW:
+                    yield ea, half[1] << 16 | imm
+                else:
+                    yield ea, ((half[1] << 16) + imm - (imm & 0x8000) * 2) & 0xFFFFFFFF
+
+
+class ConstantIndex(object):
+    """
+    Immediate values of the code above MIN_VALUE and the addresses of the
+    instructions using them, in two arrays sorted by value.
+    """
+
+    def __init__(self, pairs=()):
+        self.values = new_array()
+        self.eas = new_array()
+        for value, ea in sorted((value, ea) for ea, value in pairs if value >= MIN_VALUE):
+            self.values.append(value)
+            self.eas.append(ea)
+
+    def __len__(self):
+        return len(self.values)
+
+    def find(self, value):
+        """Return the addresses of the instructions using value."""
+        lo = bisect.bisect_left(self.values, value)
+        hi = bisect.bisect_right(self.values, value, lo)
+        return [self.eas[i] for i in range(lo, hi)]
+
+    def match(self, constants):
+        """
+        Yield (ea, Constant) for the uses of the values of constants, a dict
+        of value to list of Constants, once per instruction and rule.
+        """
+        seen = set()
+        for value in sorted(constants):
+            for ea in self.find(value):
+                for constant in constants[value]:
+                    if (ea, constant.rule) not in seen:
+                        seen.add((ea, constant.rule))
+                        yield ea, constant
+
+
+def rule_constants(filepaths):
+    """
+    Return the 4 and 8 byte hex strings of the rule files as a dict of
+    value to list of Constants. Both byte orders are included, as the
+    rules are written in memory order.
+    """
+    constants = collections.defaultdict(list)
+    for namespace in sorted(filepaths):
+        with open(filepaths[namespace]) as f:
+            header, blocks = split_rules(f.read())
+        for name, block in blocks:
+            for identifier, value in _HEX_STRING_RE.findall(block):
+                value = re.sub(r'\s', '', value)
+                if len(value) not in (8, 16):
+                    continue
+                data = binascii.unhexlify(value)
+                constant = Constant(name, identifier, data)
+                for order in (data[::-1], data):
+                    number = int(binascii.hexlify(order), 16)
+                    if number >= MIN_VALUE and constant not in constants[number]:
+                        constants[number].append(constant)
+    return constants
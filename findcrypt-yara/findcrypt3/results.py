@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# Compact storage of search results.
+
+import array
+import bisect
+
+from .segmap import new_array
+
+# Set in data_offsets for bytes kept in the pool of a store with a source.
+POOL_OFFSET = 1 << 63
+
+
+def _to_bytes(data):
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    return bytes(data)
+
+
+class ResultStore(object):
+    """
+    Hits stored by column: addresses in an integer array, rule names
+    interned, matched bytes as (offset, length) in a buffer. The buffer is
+    source when given, the snapshot the hits were found in, for hits added
+    with add, and a pool owned by the store for hits added with add_data.
+    Indexing returns (ea, rule, data) tuples built on demand.
+    """
+
+    def __init__(self, source=None):
+        self.source = source
+        self.pool = bytearray()
+        self.eas = new_array()
+        self.rule_ids = array.array("I")
+        self.data_offsets = new_array()
+        self.data_lengths = array.array("I")
+        self.rule_names = []
+        self._rule_ids = {}
+
+    def _intern(self, rule):
+        rule_id = self._rule_ids.get(rule)
+        if rule_id is None:
+            rule_id = self._rule_ids[rule] = len(self.rule_names)
+            self.rule_names.append(rule)
+        return rule_id
+
+    def add(self, ea, rule, offset, length):
+        """Add a hit whose bytes are source[offset:offset + length]."""
+        self.eas.append(ea)
+        self.rule_ids.append(self._intern(rule))
+        self.data_offsets.append(offset)
+        self.data_lengths.append(length)
+
+    def add_data(self, ea, rule, data):
+        """Add a hit and copy its bytes to the pool."""
+        offset = len(self.pool)
+        if self.source is not None:
+            offset |= POOL_OFFSET
+        self.add(ea, rule, offset, len(data))
+        self.pool.extend(data)
+
+    def detach(self):
+        """
+        Copy the bytes of the hits in source to the pool and drop source, so
+        a store kept after the search does not keep the snapshot alive.
+        """
+        if self.source is None:
+            return
+        pool = bytearray()
+        for n in range(len(self.eas)):
+            data = self.data(n)
+            self.data_offsets[n] = len(pool)
+            pool.extend(data)
+        self.pool = pool
+        self.source = None
+
+    def discard(self, ranges, rule_filter=None):
+        """
+        Remove the hits starting in the sorted, disjoint (start, end) ranges
+        and return their (ea, rule). If rule_filter is given, only the hits
+        of the rules it returns True for are removed. Their bytes are left
+        in the buffers.
+        """
+        starts = [start for start, end in ranges]
+        discarded = set(rule_id for rule_id, rule in enumerate(self.rule_names)
+                        if rule_filter is None or rule_filter(rule))
+        keep = []
+        removed = []
+        for n in range(len(self.eas)):
+            ea = self.eas[n]
+            i = bisect.bisect_right(starts, ea) - 1
+            if i >= 0 and ea < ranges[i][1] and self.rule_ids[n] in discarded:
+                removed.append((ea, self.rule(n)))
+            else:
+                keep.append(n)
+        if removed:
+            for name in ("eas", "rule_ids", "data_offsets", "data_lengths"):
+                column = getattr(self, name)
+                kept = column[:0]
+                kept.extend(column[n] for n in keep)
+                setattr(self, name, kept)
+        return removed
+
+    def __len__(self):
+        return len(self.eas)
+
+    def ea(self, n):
+        return self.eas[n]
+
+    def rule(self, n):
+        return self.rule_names[self.rule_ids[n]]
+
+    def data(self, n):
+        buf = self.pool if self.source is None else self.source
+        offset = self.data_offsets[n]
+        if offset & POOL_OFFSET:
+            buf = self.pool
+            offset &= ~POOL_OFFSET
+        return _to_bytes(buf[offset:offset + self.data_lengths[n]])
+
+    def iter_spans(self):
+        """Yield (ea, rule, length) for every hit, without its bytes."""
+        for n in range(len(self.eas)):
+            yield self.eas[n], self.rule(n), self.data_lengths[n]
+
+    def __getitem__(self, n):
+        return self.eas[n], self.rule(n), self.data(n)
+
+    def __iter__(self):
+        for n in range(len(self.eas)):
+            yield self[n]
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+#
+# Compilation of the Findcrypt rule files, with a persistent cache of the
+# compiled ruleset.
+
+import fnmatch
+import glob
+import hashlib
+import json
+import os
+import re
+import timeit
+
+import yara
+
+from .scanner import iter_match_strings
+
+YARARULES_CFGFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "findcrypt3.rules")
+
+USRDIR = os.path.join(os.getenv('HOME'), ".yara")
+if not os.path.exists(USRDIR):
+    os.makedirs(USRDIR)
+CACHEDIR = os.path.join(USRDIR, ".findcrypt3_cache")
+
+USRCFG = {}
+for fpath in glob.glob(os.path.join(USRDIR, "*.rules")):
+    name = os.path.basename(fpath)
+    USRCFG[name] = fpath
+
+CACHE_SUFFIX = ".yarc"
+
+# Compiled rulesets kept in a cache directory: the plugin, the rule
+# selections of several databases and the batch rulesets share it. The
+# least recently used ones are removed.
+CACHE_KEEP = 16
+
+_RULE_RE = re.compile(r'^[ \t]*(?:(?:private|global)\s+)*rule\s+(\w+)', re.M)
+_TAGS_RE = re.compile(r'rule\s+\w+\s*:([\w\s]*)\{')
+_META_SECTION_RE = re.compile(r'\bmeta\s*:(.*?)(?:\bstrings\s*:|\bcondition\s*:)', re.S)
+_META_RE = re.compile(r'(\w+)\s*=\s*(?:"((?:\\.|[^"\\])*)"|(\S+))')
+_COMMENT_RE = re.compile(r'"(?:\\.|[^"\\\n])*"|//[^\n]*|/\*.*?\*/', re.S)
+
+_compiled = {}
+
+
+def default_filepaths():
+    """The bundled rules and the user rules of USRDIR, by namespace."""
+    filepaths = {"global":YARARULES_CFGFILE}
+    if USRCFG:
+        filepaths.update(USRCFG)
+    return filepaths
+
+
+def rules_hash(filepaths):
+    """
+    Return a key identifying the ruleset built from filepaths (a namespace to
+    path mapping, as accepted by yara.compile): it covers the content of
+    every rule file and the yara-python version. Files pulled with include
+    are not part of the key.
+    """
+    h = hashlib.sha256()
+    h.update(getattr(yara, "__version__", "").encode("utf-8"))
+    h.update(getattr(yara, "YARA_VERSION", "").encode("utf-8"))
+    for namespace in sorted(filepaths):
+        h.update(b"\0" + namespace.encode("utf-8") + b"\0")
+        with open(filepaths[namespace], "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def _save(rules, cache_dir, key):
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    path = os.path.join(cache_dir, key + CACHE_SUFFIX)
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    rules.save(filepath=tmp)
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # Another IDA instance saved the same ruleset first
+        os.remove(tmp)
+    _prune(cache_dir)
+
+
+def _prune(cache_dir, keep=CACHE_KEEP):
+    """Remove the compiled rulesets of cache_dir but the keep last used."""
+    cached = []
+    for path in glob.glob(os.path.join(cache_dir, "*" + CACHE_SUFFIX)):
+        try:
+            cached.append((os.path.getmtime(path), path))
+        except OSError:
+            pass
+    for mtime, path in sorted(cached, reverse=True)[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def compile_rules(filepaths, cache_dir=None):
+    """
+    Return the compiled rules for filepaths. The result is kept for the
+    whole session and, if cache_dir is given, saved there so following
+    sessions only have to load it. The cache is rebuilt as soon as one of
+    the rule files changes; the CACHE_KEEP last used rulesets are kept.
+    """
+    key = rules_hash(filepaths)
+    if key in _compiled:
+        return _compiled[key]
+    rules = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, key + CACHE_SUFFIX)
+        if os.path.exists(path):
+            try:
+                rules = yara.load(filepath=path)
+                # Last use time, for _prune
+                os.utime(path, None)
+            except (yara.Error, OSError):
+                rules = None
+    if rules is None:
+        rules = yara.compile(filepaths=filepaths)
+        if cache_dir is not None:
+            try:
+                _save(rules, cache_dir, key)
+            except (OSError, IOError, yara.Error) as e:
+                print("Cannot save compiled rules in %s: %s" % (cache_dir, e))
+    _compiled.clear()
+    _compiled[key] = rules
+    return rules
+
+
+def split_rules(source):
+    """
+    Split the source of a rule file in its header (imports, comments before
+    the first rule) and a list of (rule name, rule source). Rules commented
+    out with /* */ are part of the source of the rule before them.
+    """
+    comments = [(m.start(), m.end()) for m in _COMMENT_RE.finditer(source)
+                if m.group().startswith("/*")]
+    starts = [(m.start(), m.group(1)) for m in _RULE_RE.finditer(source)
+              if not any(start < m.start() < end for start, end in comments)]
+    if not starts:
+        return source, []
+    header = source[:starts[0][0]]
+    blocks = []
+    for i, (start, name) in enumerate(starts):
+        end = starts[i + 1][0] if i + 1 < len(starts) else len(source)
+        blocks.append((name, source[start:end]))
+    return header, blocks
+
+
+def profile_rules(filepaths, data, repeat=1):
+    """
+    Compile every rule of the rule files alone and match it against data.
+    Return one dict per rule (namespace, file, rule, time, hits, error)
+    sorted by decreasing matching time; time is the best of repeat runs.
+    Rules that cannot be compiled alone (they use another rule) have an
+    error and no time.
+    """
+    profile = []
+    for namespace in sorted(filepaths):
+        with open(filepaths[namespace]) as f:
+            header, blocks = split_rules(f.read())
+        for name, block in blocks:
+            entry = {"namespace": namespace, "file": filepaths[namespace],
+                     "rule": name, "time": None, "hits": 0, "error": None}
+            try:
+                rules = yara.compile(source=header + block)
+            except yara.Error as e:
+                entry["error"] = str(e)
+                profile.append(entry)
+                continue
+            for i in range(repeat):
+                start = timeit.default_timer()
+                matches = rules.match(data=data)
+                elapsed = timeit.default_timer() - start
+                if entry["time"] is None or elapsed < entry["time"]:
+                    entry["time"] = elapsed
+            entry["hits"] = sum(len(list(iter_match_strings(match))) for match in matches)
+            profile.append(entry)
+    profile.sort(key=lambda entry: -(entry["time"] or 0))
+    return profile
+
+
+def format_profile(profile):
+    """Return the profile as a ranked table, followed by the total per file."""
+    lines = ["%4s  %-40s %-24s %10s %8s" % ("#", "Rule", "File", "Time (ms)", "Hits")]
+    per_file = {}
+    for rank, entry in enumerate(profile, 1):
+        if entry["error"] is not None:
+            lines.append("%4d  %-40s %-24s %10s %8s  %s" % (
+                rank, entry["rule"], entry["namespace"], "-", "-", entry["error"]))
+            continue
+        lines.append("%4d  %-40s %-24s %10.1f %8d" % (
+            rank, entry["rule"], entry["namespace"], entry["time"] * 1000, entry["hits"]))
+        total = per_file.setdefault(entry["namespace"], [0.0, 0])
+        total[0] += entry["time"]
+        total[1] += entry["hits"]
+    lines.append("")
+    for namespace in sorted(per_file, key=lambda n: -per_file[n][0]):
+        lines.append("      %-40s %-24s %10.1f %8d" % (
+            "(all rules)", namespace, per_file[namespace][0] * 1000, per_file[namespace][1]))
+    return "\n".join(lines)
+
+
+def write_ruleset(filepaths, keep, output_dir):
+    """
+    Write a copy of the rule files to output_dir with only the rules for
+    which keep(namespace, rule name, rule source) is true. Return the
+    filepaths of the copy, usable with compile_rules.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    written = {}
+    for namespace in sorted(filepaths):
+        with open(filepaths[namespace]) as f:
+            header, blocks = split_rules(f.read())
+        path = os.path.join(output_dir, os.path.basename(filepaths[namespace]))
+        with open(path, "w") as f:
+            f.write(header)
+            for name, block in blocks:
+                if keep(namespace, name, block):
+                    f.write(block)
+        written[namespace] = path
+    return written
+
+
+def prune_rules(filepaths, profile, budget, output_dir):
+    """
+    Write a copy of the rule files to output_dir without the rules whose
+    matching time in profile is above budget seconds. Return the filepaths
+    of the pruned ruleset.
+    """
+    slow = set((entry["namespace"], entry["rule"]) for entry in profile
+               if entry["time"] is not None and entry["time"] > budget)
+    return write_ruleset(filepaths, lambda namespace, name, block: (namespace, name) not in slow,
+                         output_dir)
+
+
+def rule_info(block):
+    """Return the tags (a list) and the meta (a dict) of a rule source."""
+    tags = []
+    m = _TAGS_RE.search(block)
+    if m:
+        tags = m.group(1).split()
+    meta = {}
+    m = _META_SECTION_RE.search(block)
+    if m:
+        for key, text, value in _META_RE.findall(m.group(1)):
+            meta[key] = text if not value else value
+    return tags, meta
+
+
+def rule_selected(name, tags, meta, selection):
+    """
+    Tell if a rule is part of selection, a dict with any of:
+
+      names    rule name patterns, one of them must match
+      tags     tags, the rule must have one of them
+      meta     meta field to pattern mapping, all of them must match
+      exclude  rule name patterns, none of them must match
+
+    Patterns are fnmatch patterns; meta patterns are case insensitive.
+    """
+    names = selection.get("names")
+    if names and not any(fnmatch.fnmatchcase(name, p) for p in names):
+        return False
+    wanted_tags = selection.get("tags")
+    if wanted_tags and not set(wanted_tags) & set(tags):
+        return False
+    for key, pattern in (selection.get("meta") or {}).items():
+        if not fnmatch.fnmatch(str(meta.get(key, "")).lower(), pattern.lower()):
+            return False
+    for pattern in selection.get("exclude") or []:
+        if fnmatch.fnmatchcase(name, pattern):
+            return False
+    return True
+
+
+def select_rules(filepaths, selection, output_dir):
+    """
+    Write the rules of filepaths which are part of selection to a directory
+    of output_dir and return the filepaths of this subset. Rules using a
+    rule which is not selected will fail to compile.
+    """
+    key = hashlib.sha256(json.dumps(selection, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def keep(namespace, name, block):
+        tags, meta = rule_info(block)
+        return rule_selected(name, tags, meta, selection)
+
+    return write_ruleset(filepaths, keep, os.path.join(output_dir, key[:16]))
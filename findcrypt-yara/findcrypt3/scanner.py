@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+#
+# Scanning helpers shared by the Findcrypt plugin. Nothing in here depends on
+# IDA: bytes are obtained through a read callback so the same code can scan
+# database segments, a snapshot buffer or a file.
+
+import collections
+import math
+import multiprocessing
+import re
+import timeit
+from multiprocessing.pool import ThreadPool
+
+import yara
+
+# Size of the part of a segment owned by one chunk in streaming mode.
+CHUNK_SIZE = 0x1000000
+
+# Smaller chunks in parallel mode so the work is spread evenly over threads.
+PARALLEL_CHUNK_SIZE = 0x400000
+
+# YARA does not allow more threads to scan with the same rules.
+MAX_WORKERS = 32
+
+# Upper bound used for regular expressions with unbounded repetitions. YARA
+# does not let a regexp match more than this many bytes anyway.
+REGEX_MAX_LENGTH = 4096
+
+# address is in the address space of the read callback used for the scan:
+# an ea when reading from the database, an offset when reading a buffer.
+Hit = collections.namedtuple("Hit", ["address", "rule", "identifier", "data"])
+
+_STRING_RE = re.compile(
+    r'\$\w*\s*=\s*'
+    r'(\{[^}]*\}|"(?:\\.|[^"\\\n])*"|/(?:\\.|[^/\\\n])*/[is]*)'
+    # Modifiers, with their arguments as in xor(1-255) or base64("...")
+    r'((?:[ \t]+\w+(?:\((?:"(?:\\.|[^"\\\n])*"|[^)"\n])*\))?)*)')
+_HEX_JUMP_RE = re.compile(r'\[\s*(\d*)\s*(-?)\s*(\d*)\s*\]')
+_REGEX_REPEAT_RE = re.compile(r'\{\s*(\d*)\s*(,?)\s*(\d*)\s*\}')
+
+
+def _hex_string_length(value):
+    body = value[1:-1]
+    length = 0
+    for low, dash, high in _HEX_JUMP_RE.findall(body):
+        if dash and not high:
+            return REGEX_MAX_LENGTH
+        length += int(high or low or 0)
+    body = _HEX_JUMP_RE.sub("", body)
+    # Alternatives are counted as if they were all present, that can only
+    # make the result larger than needed.
+    return length + len(re.findall(r'[0-9a-fA-F?~]{2}', body))
+
+
+def _regex_atom_length(body, i):
+    """Return (upper bound of the bytes matched by the atom at i, next index)."""
+    c = body[i]
+    if c == "\\":
+        if body[i + 1:i + 2] == "x":
+            return 1, i + 4
+        # Word boundaries match no byte
+        return (0 if body[i + 1:i + 2] in ("b", "B") else 1), i + 2
+    if c == "[":
+        i += 1
+        if body[i:i + 1] == "^":
+            i += 1
+        # A ] right after [ or [^ is a literal
+        if body[i:i + 1] == "]":
+            i += 1
+        while i < len(body) and body[i] != "]":
+            i += 2 if body[i] == "\\" else 1
+        return 1, i + 1
+    if c == "(":
+        length, i = _regex_alternatives_length(body, i + 1)
+        return length, i + 1
+    if c in "^$":
+        return 0, i + 1
+    return 1, i + 1
+
+
+def _regex_alternatives_length(body, i):
+    """
+    Return (upper bound of the bytes matched by the alternatives starting at
+    i, index of the closing parenthesis or end of body).
+    """
+    longest = length = 0
+    while i < len(body) and body[i] != ")":
+        if body[i] == "|":
+            longest = max(longest, length)
+            length = 0
+            i += 1
+            continue
+        atom, i = _regex_atom_length(body, i)
+        # The quantifier applies to the whole atom, a group included
+        repeat = _REGEX_REPEAT_RE.match(body, i)
+        quantified = True
+        if body[i:i + 1] in ("*", "+"):
+            atom *= REGEX_MAX_LENGTH
+            i += 1
+        elif body[i:i + 1] == "?":
+            i += 1
+        elif repeat:
+            low, comma, high = repeat.groups()
+            atom *= REGEX_MAX_LENGTH if comma and not high else int(high or low or 0)
+            i = repeat.end()
+        else:
+            quantified = False
+        if quantified and body[i:i + 1] == "?":
+            # Non greedy
+            i += 1
+        length = min(length + atom, REGEX_MAX_LENGTH)
+    return max(longest, length), i
+
+
+def _regex_length(value):
+    body = value[1:value.rindex("/")]
+    return min(_regex_alternatives_length(body, 0)[0], REGEX_MAX_LENGTH)
+
+
+def _text_string_length(value):
+    body = value[1:-1]
+    # Every escape sequence is a single byte
+    return len(body) - sum(len(escape) - 1 for escape in re.findall(r'\\(?:x[0-9a-fA-F]{2}|.)', body))
+
+
+def _base64_length(length):
+    """Upper bound of the base64 encoding of length bytes at any offset."""
+    return 4 * ((length + 2) // 3 + 1)
+
+
+def string_max_length(value, modifiers=""):
+    """
+    Return an upper bound of the number of bytes a YARA string definition
+    (text, hex or regexp, as written in the rule) can match.
+    """
+    if value.startswith("{"):
+        length = _hex_string_length(value)
+    elif value.startswith("/"):
+        length = _regex_length(value)
+    else:
+        length = _text_string_length(value)
+    if "wide" in modifiers.split():
+        length *= 2
+    base64 = re.findall(r'\bbase64(wide)?\b', modifiers)
+    if base64:
+        encoded = _base64_length(length)
+        length = max(encoded * 2 if wide else encoded for wide in base64)
+    return length
+
+
+def longest_string_length(filepaths):
+    """
+    Return the length of the longest string defined by the rule files. This
+    is the overlap needed between two chunks so no match is lost at the
+    boundary.
+    """
+    longest = 0
+    for fpath in filepaths:
+        with open(fpath) as f:
+            source = f.read()
+        for value, modifiers in _STRING_RE.findall(source):
+            longest = max(longest, string_max_length(value, modifiers))
+    return longest
+
+
+def iter_match_strings(match):
+    """
+    Yield (offset, identifier, data) for every string of a yara match. Older
+    yara-python versions return tuples, 4.3 and later StringMatch objects.
+    """
+    for string in match.strings:
+        if isinstance(string, tuple):
+            yield string
+        else:
+            for instance in string.instances:
+                yield instance.offset, string.identifier, instance.matched_data
+
+
+def iter_chunks(start, end, chunk_size, overlap):
+    """
+    Split [start, end) into chunks. Yield (own_start, own_end, win_start,
+    win_end): the owned parts partition the range, the window is what must
+    be scanned so any match starting in the owned part and no longer than
+    overlap is complete. One byte before the owned part is kept for the
+    fullword modifier.
+    """
+    for own_start in range(start, end, chunk_size):
+        own_end = min(own_start + chunk_size, end)
+        win_start = max(start, own_start - 1)
+        win_end = min(end, own_end + overlap)
+        yield own_start, own_end, win_start, win_end
+
+
+class ScanBudget(object):
+    """
+    Limits of a chunked scan: timeout for the whole scan and chunk_timeout
+    for each chunk, in seconds, and max_hits_per_rule. Chunks which time
+    out or start after the deadline are skipped and hits over the cap are
+    dropped; both are recorded for the summary.
+    """
+
+    def __init__(self, timeout=None, chunk_timeout=None, max_hits_per_rule=None):
+        self.timeout = timeout
+        self.chunk_timeout = chunk_timeout
+        self.max_hits_per_rule = max_hits_per_rule
+        self.deadline = None
+        self.skipped = []
+        self.hit_counts = {}
+        self.dropped = {}
+
+    def start(self):
+        """Start the overall timeout, unless it is already running."""
+        if self.timeout is not None and self.deadline is None:
+            self.deadline = timeit.default_timer() + self.timeout
+
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return self.deadline - timeit.default_timer()
+
+    def match_timeout(self):
+        """Return the timeout for the next yara match, None if unlimited."""
+        timeouts = [t for t in (self.chunk_timeout, self.remaining()) if t is not None]
+        if not timeouts:
+            return None
+        # yara timeouts are whole seconds
+        return max(1, int(math.ceil(min(timeouts))))
+
+    def expired(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def skip(self, start, end, reason):
+        self.skipped.append((start, end, reason))
+
+    def accept(self, hit):
+        """Count hit for its rule, return False if the rule is over its cap."""
+        count = self.hit_counts.get(hit.rule, 0) + 1
+        self.hit_counts[hit.rule] = count
+        if self.max_hits_per_rule is not None and count > self.max_hits_per_rule:
+            self.dropped[hit.rule] = self.dropped.get(hit.rule, 0) + 1
+            return False
+        return True
+
+    def cut_count(self):
+        """Number of skipped chunks and dropped hits so far."""
+        return len(self.skipped) + sum(self.dropped.values())
+
+    def summary(self, format_address=hex):
+        lines = []
+        for start, end, reason in self.skipped:
+            lines.append("%s-%s not scanned (%s)" % (format_address(start), format_address(end), reason))
+        for rule in sorted(self.dropped):
+            lines.append("%s: %d hits over the limit of %d dropped" % (
+                rule, self.dropped[rule], self.max_hits_per_rule))
+        return "\n".join(lines)
+
+
+def scan_chunk(rules, data, win_start, own_start, own_end, timeout=None):
+    """
+    Match data, the bytes of the window starting at win_start, and return
+    the hits starting in [own_start, own_end).
+    """
+    hits = []
+    if timeout is None:
+        matches = rules.match(data=data)
+    else:
+        matches = rules.match(data=data, timeout=timeout)
+    for match in matches:
+        for offset, identifier, value in iter_match_strings(match):
+            address = win_start + offset
+            if own_start <= address < own_end:
+                hits.append(Hit(address, match.rule, identifier, value))
+    return hits
+
+
+def _scan_unit(rules, read, unit, budget):
+    """Scan one chunk within budget, return its hits or None if skipped."""
+    own_start, own_end, win_start, win_end = unit
+    timeout = None
+    if budget is not None:
+        if budget.expired():
+            budget.skip(own_start, own_end, "scan timeout")
+            return None
+        timeout = budget.match_timeout()
+    data = read(win_start, win_end - win_start)
+    try:
+        return scan_chunk(rules, data, win_start, own_start, own_end, timeout)
+    except yara.TimeoutError:
+        budget.skip(own_start, own_end, "timeout")
+        return None
+
+
+def iter_stream_hits(rules, ranges, read, chunk_size=CHUNK_SIZE, overlap=0,
+                     budget=None):
+    """
+    Scan the address ranges chunk by chunk and yield a Hit for every matched
+    string as soon as its chunk is scanned. read(address, size) must return
+    a buffer with the bytes of [address, address + size); only one chunk is
+    needed in memory at a time. If a ScanBudget is given, it is started and
+    the hits it cuts are not yielded.
+    """
+    if budget is not None:
+        budget.start()
+    for start, end in ranges:
+        for unit in iter_chunks(start, end, chunk_size, overlap):
+            for hit in _scan_unit(rules, read, unit, budget) or []:
+                if budget is None or budget.accept(hit):
+                    yield hit
+
+
+def default_workers():
+    try:
+        count = multiprocessing.cpu_count()
+    except NotImplementedError:
+        count = 1
+    return max(1, min(count, MAX_WORKERS))
+
+
+def iter_parallel_hits(rules, ranges, read, chunk_size=PARALLEL_CHUNK_SIZE,
+                       overlap=0, workers=None, budget=None):
+    """
+    Same as iter_stream_hits but chunks are matched on a thread pool, yara
+    releases the GIL while matching. read is called from the worker threads
+    so it must not use the IDA API: give it a view on a snapshot. Every hit
+    is only reported by the chunk owning its start address, so merging the
+    chunks results in order gives each hit exactly once, sorted by range.
+    """
+    units = []
+    for start, end in ranges:
+        units.extend(iter_chunks(start, end, chunk_size, overlap))
+    if budget is not None:
+        budget.start()
+
+    def work(unit):
+        return _scan_unit(rules, read, unit, budget)
+
+    pool = ThreadPool(min(workers or default_workers(), MAX_WORKERS))
+    try:
+        for hits in pool.imap(work, units):
+            for hit in hits or []:
+                if budget is None or budget.accept(hit):
+                    yield hit
+    finally:
+        pool.terminate()
+        pool.join()
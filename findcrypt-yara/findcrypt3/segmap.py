@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# Mapping between offsets in a scanned buffer and virtual addresses.
+
+import array
+import bisect
+
+
+def new_array():
+    """Return an empty array of 64 bit unsigned integers."""
+    try:
+        return array.array("Q")
+    except ValueError:
+        # Python 2 has no 64 bit type code
+        return []
+
+
+class SegmentMap(object):
+    """
+    Sorted table of (ea, offset, end) entries: bytes [offset, end) of the
+    buffer are the bytes at ea. Entries must be added by increasing offset;
+    translation is a binary search over the offsets.
+    """
+
+    def __init__(self):
+        self.eas = new_array()
+        self.offsets = new_array()
+        self.ends = new_array()
+
+    def add(self, ea, offset, end):
+        if self.ends and offset < self.ends[-1]:
+            raise ValueError("segments must be added by increasing offset")
+        self.eas.append(ea)
+        self.offsets.append(offset)
+        self.ends.append(end)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        for i in range(len(self.offsets)):
+            yield self.eas[i], self.offsets[i], self.ends[i]
+
+    def find(self, offset):
+        """Return the index of the entry containing offset, or -1."""
+        i = bisect.bisect_right(self.offsets, offset) - 1
+        if i >= 0 and offset < self.ends[i]:
+            return i
+        return -1
+
+    def to_ea(self, offset):
+        """Return the address of the byte at offset, None if unmapped."""
+        i = self.find(offset)
+        if i < 0:
+            return None
+        return self.eas[i] + (offset - self.offsets[i])
+
+    def to_eas(self, offsets):
+        """
+        Translate a batch of offsets, in any order. The offsets are sorted
+        once and walked together with the table, so the cost is dominated by
+        the sort instead of one search per offset.
+        """
+        result = [None] * len(offsets)
+        order = sorted(range(len(offsets)), key=offsets.__getitem__)
+        i = -1
+        count = len(self.offsets)
+        for n in order:
+            offset = offsets[n]
+            if i < 0 or offset >= self.ends[i]:
+                # Skip to the last segment starting at or before offset
+                if i + 1 < count and self.offsets[i + 1] <= offset:
+                    i = bisect.bisect_right(self.offsets, offset, i + 1) - 1
+                if i < 0 or offset >= self.ends[i]:
+                    continue
+            result[n] = self.eas[i] + (offset - self.offsets[i])
+        return result
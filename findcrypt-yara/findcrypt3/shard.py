@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+#
+# Sharded matching: the rules are split in groups of about the same cost and
+# every group is matched by its own worker process against one copy of the
+# snapshot, a file in shared memory mapped by all workers. Workers only need
+# yara-python, they are run with
+#
+#   python -m findcrypt3.shard SNAPSHOT SHARD_DIR NAMESPACE=PATH...
+
+import argparse
+import binascii
+import json
+import mmap
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+import yara
+
+from . import rules as rulesmod
+from . import scanner
+
+# Estimated cost of a rule: one per rule and per string, regular expressions
+# are matched much slower than text and hex strings.
+REGEX_WEIGHT = 16
+
+# tmpfs, the snapshot file stays in memory and is shared by the workers.
+SHARED_DIR = "/dev/shm"
+
+_WORD_RE = re.compile(r'\w+')
+_GLOBAL_RE = re.compile(r'^\s*(?:private\s+)?global\b')
+_REGEX_STRING_RE = re.compile(r'\$\w*\s*=\s*/')
+
+
+def rule_cost(block):
+    """Estimated matching cost of the source of a rule."""
+    strings = scanner._STRING_RE.findall(block)
+    regexes = len(_REGEX_STRING_RE.findall(block))
+    return 1 + len(strings) + (REGEX_WEIGHT - 1) * regexes
+
+
+def shard_rules(filepaths, count, output_dir):
+    """
+    Split the rules of filepaths in at most count shards of about the same
+    estimated cost and write them to directories of output_dir. Rules using
+    each other, and the global rules with the rest of their file, are kept
+    in the same shard. Return the filepaths of every non empty shard.
+    """
+    parent = {}
+
+    def find(key):
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    costs = {}
+    for namespace in sorted(filepaths):
+        with open(filepaths[namespace]) as f:
+            header, blocks = rulesmod.split_rules(f.read())
+        names = set(name for name, block in blocks)
+        for name, block in blocks:
+            parent[(namespace, name)] = (namespace, name)
+            costs[(namespace, name)] = rule_cost(block)
+        for name, block in blocks:
+            used = set(_WORD_RE.findall(block)) & names
+            if _GLOBAL_RE.match(block):
+                used = names
+            for other in used:
+                parent[find((namespace, other))] = find((namespace, name))
+    groups = {}
+    for key in sorted(parent):
+        groups.setdefault(find(key), []).append(key)
+    # Largest groups first, each to the lightest shard
+    shards = [[0, set()] for i in range(max(1, count))]
+    for group in sorted(groups.values(), key=lambda group: -sum(costs[key] for key in group)):
+        shard = min(shards, key=lambda shard: shard[0])
+        shard[0] += sum(costs[key] for key in group)
+        shard[1].update(group)
+    key = rulesmod.rules_hash(filepaths)[:16]
+    written = []
+    for i, (cost, keys) in enumerate(shard for shard in shards if shard[1]):
+        written.append(rulesmod.write_ruleset(
+            filepaths, lambda namespace, name, block, keys=keys: (namespace, name) in keys,
+            os.path.join(output_dir, "%s-%d" % (key, count), str(i))))
+    return written
+
+
+def python_executable():
+    """
+    Interpreter to run the workers with: the current one, unless Python is
+    embedded in another program (IDA) in which case the one in the PATH.
+    """
+    if os.path.basename(sys.executable or "").lower().startswith("python"):
+        return sys.executable
+    return "python3" if sys.version_info[0] >= 3 else "python"
+
+
+def _write_snapshot(memory):
+    directory = SHARED_DIR if os.path.isdir(SHARED_DIR) else None
+    fd, path = tempfile.mkstemp(prefix="findcrypt3-", suffix=".snapshot", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(memory)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+def iter_sharded_hits(memory, shards, python=None, budget=None):
+    """
+    Match memory with every shard of rules (filepaths as returned by
+    shard_rules) in its own process and yield the Hits, sorted by offset.
+    With a budget, the hits are capped per rule and a shard which times out
+    skips the whole snapshot for its rules.
+    """
+    if not len(memory) or not shards:
+        return
+    timeout = None
+    if budget is not None:
+        budget.start()
+        timeout = budget.match_timeout()
+    env = dict(os.environ)
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join([package_dir] + [path for path in [env.get("PYTHONPATH")] if path])
+    path = _write_snapshot(memory)
+    workers = []
+    try:
+        for filepaths in shards:
+            args = [python or python_executable(), "-m", "findcrypt3.shard", path,
+                    os.path.dirname(list(filepaths.values())[0])]
+            if timeout is not None:
+                args += ["--timeout", str(timeout)]
+            args += ["%s=%s" % (namespace, filepaths[namespace]) for namespace in sorted(filepaths)]
+            output = tempfile.TemporaryFile()
+            workers.append((subprocess.Popen(args, stdout=output, stderr=subprocess.STDOUT, env=env),
+                            output))
+        hits = []
+        for i, (process, output) in enumerate(workers):
+            process.wait()
+            output.seek(0)
+            for line in output:
+                try:
+                    record = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    # Not a hit: a traceback of a worker which failed to start
+                    print("Findcrypt shard %d: %s" % (i, line.decode("utf-8", "replace").rstrip()))
+                    continue
+                if "error" in record:
+                    if budget is not None and record["error"] == "timeout":
+                        budget.skip(0, len(memory), "timeout in rule shard %d" % i)
+                    else:
+                        print("Findcrypt shard %d: %s" % (i, record["error"]))
+                    continue
+                hits.append(scanner.Hit(record["offset"], record["rule"], record["identifier"],
+                                        binascii.unhexlify(record["data"])))
+    finally:
+        for process, output in workers:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            output.close()
+        os.remove(path)
+    hits.sort(key=lambda hit: (hit.address, hit.rule))
+    for hit in hits:
+        if budget is None or budget.accept(hit):
+            yield hit
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Match a snapshot with one shard of the Findcrypt rules.")
+    parser.add_argument("snapshot", help="file to match")
+    parser.add_argument("cache_dir", help="directory of the compiled shard")
+    parser.add_argument("rules", nargs="+", help="rule files as NAMESPACE=PATH")
+    parser.add_argument("--timeout", type=int, help="yara timeout in seconds")
+    args = parser.parse_args(argv)
+
+    filepaths = dict(arg.split("=", 1) for arg in args.rules)
+    out = sys.stdout
+    try:
+        rules = rulesmod.compile_rules(filepaths, args.cache_dir)
+        with open(args.snapshot, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if args.timeout is None:
+                matches = rules.match(data=data)
+            else:
+                matches = rules.match(data=data, timeout=args.timeout)
+        finally:
+            data.close()
+    except yara.TimeoutError:
+        out.write(json.dumps({"error": "timeout"}) + "\n")
+        return 1
+    except (yara.Error, EnvironmentError) as e:
+        out.write(json.dumps({"error": str(e)}) + "\n")
+        return 1
+    for match in matches:
+        for offset, identifier, value in scanner.iter_match_strings(match):
+            out.write(json.dumps({
+                "offset": offset,
+                "rule": match.rule,
+                "identifier": identifier,
+                "data": binascii.hexlify(value).decode("ascii"),
+            }, sort_keys=True) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
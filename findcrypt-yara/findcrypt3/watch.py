@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+#
+# Bookkeeping of the ranges changed since the last scan, for the watch mode
+# which rescans patched bytes as they change.
+
+import bisect
+
+
+class DirtyRanges(object):
+    """
+    Sorted, disjoint [start, end) ranges. Added ranges are merged with the
+    ranges they overlap or touch.
+    """
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return iter(zip(self.starts, self.ends))
+
+    def add(self, start, end):
+        i = bisect.bisect_left(self.ends, start)
+        j = bisect.bisect_right(self.starts, end)
+        if i < j:
+            start = min(start, self.starts[i])
+            end = max(end, self.ends[j - 1])
+        self.starts[i:j] = [start]
+        self.ends[i:j] = [end]
+
+    def pop_all(self):
+        """Return the ranges as a list and forget them."""
+        ranges = list(self)
+        self.starts = []
+        self.ends = []
+        return ranges
+
+
+def rescan_units(dirty, bounds, overlap):
+    """
+    Return the chunks to rescan for the dirty ranges, as the units of
+    scanner.iter_chunks: (own_start, own_end, win_start, win_end). A match
+    including a changed byte starts at most overlap bytes before it, so
+    the owned part of a chunk is the dirty range extended by overlap bytes
+    backwards, and one byte forwards for the fullword modifier. Chunks are
+    clipped to the sorted (start, end) bounds, the scanned segments, and
+    merged when they overlap.
+    """
+    padded = {}
+    starts = [start for start, end in bounds]
+    for start, end in dirty:
+        i = max(0, bisect.bisect_right(starts, start - overlap) - 1)
+        while i < len(bounds) and bounds[i][0] <= end:
+            own_start = max(bounds[i][0], start - overlap)
+            own_end = min(bounds[i][1], end + 1)
+            if own_start < own_end:
+                padded.setdefault(i, DirtyRanges()).add(own_start, own_end)
+            i += 1
+    units = []
+    for i in sorted(padded):
+        bound_start, bound_end = bounds[i]
+        for own_start, own_end in padded[i]:
+            units.append((own_start, own_end, max(bound_start, own_start - 1),
+                          min(bound_end, own_end + overlap)))
+    return units
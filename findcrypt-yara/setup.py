@@ -9,5 +9,8 @@ setup(name='findcrypt3',
       entry_points={
           "idapython_plugins": [
               "findcrypt3=findcrypt3.findcrypt3:Findcrypt_Plugin_t",
-          ]
+          ],
+          "console_scripts": [
+              "findcrypt3-batch=findcrypt3.batch:main",
+          ],
       })
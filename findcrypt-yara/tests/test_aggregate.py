@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+from findcrypt3.aggregate import HitRange, RuleSummary, aggregate, summarize
+
+
+def test_aggregate_merges_overlapping_and_touching():
+    spans = [(0x110, "AES", 0x10), (0x100, "AES", 0x10), (0x118, "AES", 0x10), (0x200, "AES", 4)]
+    assert aggregate(spans) == [HitRange(0x100, 0x128, "AES", 3), HitRange(0x200, 0x204, "AES", 1)]
+
+
+def test_aggregate_rules_apart():
+    spans = [(0x100, "AES", 0x10), (0x108, "MD5", 4), (0x104, "AES", 4)]
+    assert aggregate(spans) == [HitRange(0x100, 0x110, "AES", 2), HitRange(0x108, 0x10c, "MD5", 1)]
+
+
+def test_aggregate_gap():
+    spans = [(0x100, "AES", 4), (0x110, "AES", 4), (0x200, "AES", 4)]
+    assert aggregate(spans) == [HitRange(0x100, 0x104, "AES", 1), HitRange(0x110, 0x114, "AES", 1),
+                                HitRange(0x200, 0x204, "AES", 1)]
+    assert aggregate(spans, gap=0x10) == [HitRange(0x100, 0x114, "AES", 2), HitRange(0x200, 0x204, "AES", 1)]
+
+
+def test_aggregate_empty_hit_covers_one_byte():
+    assert aggregate([(0x100, "R", 0)]) == [HitRange(0x100, 0x101, "R", 1)]
+
+
+def test_summarize():
+    ranges = [HitRange(0x100, 0x128, "AES", 3), HitRange(0x108, 0x10c, "MD5", 1),
+              HitRange(0x200, 0x204, "AES", 1), HitRange(0x300, 0x304, "MD5", 1)]
+    assert summarize(ranges) == [
+        RuleSummary("AES", 4, 2, 0x2c, 0x100, 0x204),
+        RuleSummary("MD5", 2, 2, 8, 0x108, 0x304),
+    ]
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+import struct
+
+import yara
+
+from findcrypt3 import batch
+
+PT_LOAD, PT_NOTE = 1, 4
+SHT_PROGBITS, SHT_NOBITS = 1, 8
+SHF_WRITE, SHF_ALLOC = 0x1, 0x2
+
+
+def elf(bits, endian, loads=(), sections=(), size=0x1000):
+    """
+    Build an ELF file of size bytes with program headers for loads, a list
+    of (p_type, offset, vaddr, filesz), and section headers for sections, a
+    list of (sh_type, sh_flags, addr, offset, size).
+    """
+    e = "<" if endian == "little" else ">"
+    data = bytearray(size)
+    data[:4] = b"\x7fELF"
+    data[4] = 2 if bits == 64 else 1
+    data[5] = 1 if endian == "little" else 2
+    phoff, shoff = 0x100, 0x400
+    if bits == 64:
+        struct.pack_into(e + "QQ", data, 32, phoff, shoff)
+        struct.pack_into(e + "HHHH", data, 54, 56, len(loads), 64, len(sections))
+        for i, (p_type, offset, vaddr, filesz) in enumerate(loads):
+            struct.pack_into(e + "IIQQQQQQ", data, phoff + i * 56,
+                             p_type, 5, offset, vaddr, vaddr, filesz, filesz, 0x1000)
+        for i, (sh_type, flags, addr, offset, sh_size) in enumerate(sections):
+            struct.pack_into(e + "IIQQQQ", data, shoff + i * 64,
+                             0, sh_type, flags, addr, offset, sh_size)
+    else:
+        struct.pack_into(e + "II", data, 28, phoff, shoff)
+        struct.pack_into(e + "HHHH", data, 42, 32, len(loads), 40, len(sections))
+        for i, (p_type, offset, vaddr, filesz) in enumerate(loads):
+            struct.pack_into(e + "IIIIIIII", data, phoff + i * 32,
+                             p_type, offset, vaddr, vaddr, filesz, filesz, 5, 0x1000)
+        for i, (sh_type, flags, addr, offset, sh_size) in enumerate(sections):
+            struct.pack_into(e + "IIIIII", data, shoff + i * 40,
+                             0, sh_type, flags, addr, offset, sh_size)
+    return data
+
+
+def pe(plus, image_base, headers_size, sections, size=0x2000):
+    """
+    Build a PE file of size bytes with sections, a list of (vsize, vaddr,
+    rawsize, rawptr).
+    """
+    data = bytearray(size)
+    data[:2] = b"MZ"
+    pe_offset = 0x80
+    struct.pack_into("<I", data, 0x3c, pe_offset)
+    data[pe_offset:pe_offset + 4] = b"PE\0\0"
+    optsize = 0xf0 if plus else 0xe0
+    struct.pack_into("<HH", data, pe_offset + 4, 0x8664 if plus else 0x14c, len(sections))
+    struct.pack_into("<H", data, pe_offset + 20, optsize)
+    opt = pe_offset + 24
+    if plus:
+        struct.pack_into("<HQ", data, opt, 0x20b, 0)
+        struct.pack_into("<Q", data, opt + 24, image_base)
+    else:
+        struct.pack_into("<H", data, opt, 0x10b)
+        struct.pack_into("<I", data, opt + 28, image_base)
+    struct.pack_into("<I", data, opt + 60, headers_size)
+    for i, (vsize, vaddr, rawsize, rawptr) in enumerate(sections):
+        struct.pack_into("<8sIIII", data, opt + optsize + i * 40,
+                         b".s%d" % i, vsize, vaddr, rawsize, rawptr)
+    return data
+
+
+def test_elf64_program_headers():
+    data = elf(64, "little", [(PT_LOAD, 0, 0x400000, 0x800), (PT_NOTE, 0x800, 0, 0x10),
+                              (PT_LOAD, 0x800, 0x600800, 0x400)])
+    assert batch._elf_ranges(data) == [(0, 0x800, 0x400000), (0x800, 0x400, 0x600800)]
+
+
+def test_elf32_big_endian_program_headers():
+    data = elf(32, "big", [(PT_LOAD, 0, 0x10000, 0x600), (PT_LOAD, 0x600, 0x20600, 0x200)])
+    assert batch._elf_ranges(data) == [(0, 0x600, 0x10000), (0x600, 0x200, 0x20600)]
+
+
+def test_elf_relocatable_uses_allocated_sections():
+    for bits in (32, 64):
+        data = elf(bits, "little", sections=[
+            (0, 0, 0, 0, 0),
+            (SHT_PROGBITS, SHF_ALLOC, 0, 0x40, 0x100),
+            (SHT_PROGBITS, 0, 0, 0x140, 0x20),
+            (SHT_NOBITS, SHF_ALLOC | SHF_WRITE, 0x100, 0x160, 0x80),
+            (SHT_PROGBITS, SHF_ALLOC | SHF_WRITE, 0x180, 0x160, 0x40),
+        ])
+        assert batch._elf_ranges(data) == [(0x40, 0x100, 0), (0x160, 0x40, 0x180)]
+
+
+def test_pe32_sections():
+    data = pe(False, 0x400000, 0x400, [(0x300, 0x1000, 0x400, 0x400), (0x1000, 0x2000, 0x200, 0x800)])
+    assert batch._pe_ranges(data) == [(0, 0x400, 0x400000), (0x400, 0x300, 0x401000),
+                                      (0x800, 0x200, 0x402000)]
+
+
+def test_pe32_plus_sections():
+    data = pe(True, 0x140000000, 0x400, [(0, 0x1000, 0x600, 0x400)])
+    assert batch._pe_ranges(data) == [(0, 0x400, 0x140000000), (0x400, 0x600, 0x140001000)]
+
+
+def test_file_segments_pe():
+    data = pe(True, 0x140000000, 0x400, [(0x800, 0x1000, 0x800, 0x400)])
+    assert list(batch.file_segments(data)) == [(0x140000000, 0, 0x400), (0x140001000, 0x400, 0xc00)]
+
+
+def test_file_segments_trims_overlaps_and_truncates():
+    data = elf(64, "little", [(PT_LOAD, 0, 0x400000, 0x800), (PT_LOAD, 0x700, 0x600700, 0x2000)])
+    # The second segment starts in the first one and runs past the file end
+    assert list(batch.file_segments(data)) == [(0x400000, 0, 0x800), (0x600800, 0x800, 0x1000)]
+
+
+def test_file_segments_other_files_at_base():
+    assert list(batch.file_segments(b"\0" * 0x100, base=0x1000)) == [(0x1000, 0, 0x100)]
+    # Truncated headers are mapped at base too
+    assert list(batch.file_segments(b"\x7fELF\x02\x01", base=0x1000)) == [(0x1000, 0, 6)]
+
+
+def test_scan_file_addresses(tmpdir):
+    data = elf(32, "little", [(PT_LOAD, 0, 0x8000, 0x800), (PT_LOAD, 0x800, 0x20000, 0x400)],
+               size=0x1000)
+    data[0x900:0x904] = b"\x01\x23\x45\x67"
+    data[0xc80:0xc84] = b"\x01\x23\x45\x67"
+    path = tmpdir.join("sample.elf")
+    path.write_binary(bytes(data))
+    rules = yara.compile(source="rule Const { strings: $c = { 01 23 45 67 } condition: $c }")
+    records = batch.scan_file(str(path), rules)
+    assert [(r["offset"], r["ea"], r["rule"], r["data"]) for r in records] == [
+        (0x900, 0x20100, "Const", "01234567"),
+        (0xc80, None, "Const", "01234567"),
+    ]
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from findcrypt3 import diff, export
+from findcrypt3.scanner import Hit
+
+
+def changes(result):
+    return [(c.kind, c.rule, c.old_ea, c.new_ea) for c in result.changes]
+
+
+def test_diff_hits_single():
+    old = [(0x100, "AES", b"\x63\x7c"), (0x200, "MD5", b"\x01\x23"), (0x300, "SHA1", b"\x67\x45")]
+    new = [(0x100, "AES", b"\x63\x7c"), (0x240, "MD5", b"\x01\x23"), (0x500, "TEA", b"\x9e\x37")]
+    result = diff.diff_hits(old, new)
+    assert result.unchanged == 1
+    assert changes(result) == [
+        ("relocated", "MD5", 0x200, 0x240),
+        ("removed", "SHA1", 0x300, None),
+        ("added", "TEA", None, 0x500),
+    ]
+
+
+def test_diff_hits_same_bytes_other_rule():
+    result = diff.diff_hits([(0x100, "MD5", b"\x01\x23")], [(0x100, "SHA1", b"\x01\x23")])
+    assert result.unchanged == 0
+    assert changes(result) == [("removed", "MD5", 0x100, None), ("added", "SHA1", None, 0x100)]
+
+
+def test_diff_hits_pairs_along_common_shifts():
+    # Unique hits moved by 0x40 give the shift to pair the repeated ones
+    old = [(0x1000, "A", b"a"), (0x2000, "B", b"b"),
+           (0x3000, "R", b"r"), (0x3100, "R", b"r"), (0x3200, "R", b"r")]
+    new = [(0x1040, "A", b"a"), (0x2040, "B", b"b"),
+           (0x3000, "R", b"r"), (0x3140, "R", b"r"), (0x3240, "R", b"r"), (0x3300, "R", b"r")]
+    result = diff.diff_hits(old, new)
+    assert result.unchanged == 1
+    assert changes(result) == [
+        ("relocated", "A", 0x1000, 0x1040),
+        ("relocated", "B", 0x2000, 0x2040),
+        ("relocated", "R", 0x3100, 0x3140),
+        ("relocated", "R", 0x3200, 0x3240),
+        ("added", "R", None, 0x3300),
+    ]
+
+
+def test_diff_hits_pairs_rest_in_address_order():
+    old = [(0x100, "R", b"r"), (0x200, "R", b"r"), (0x300, "R", b"r")]
+    new = [(0x150, "R", b"r"), (0x270, "R", b"r")]
+    result = diff.diff_hits(old, new)
+    assert changes(result) == [
+        ("relocated", "R", 0x100, 0x150),
+        ("relocated", "R", 0x200, 0x270),
+        ("removed", "R", 0x300, None),
+    ]
+
+
+def written(tmpdir, name, fmt):
+    path = str(tmpdir.join(name))
+    hits = [Hit(0x401000, "AES", "$c0", b"\x63\x7c"), Hit(0x402000, "MD5", "$c0", b"\x01\x23")]
+    with export.open_output(path) as output:
+        export.write_hits(hits, output, fmt, {"AES": {"author": "x"}})
+    return path
+
+
+def test_load_export_jsonl(tmpdir):
+    path = written(tmpdir, "hits.jsonl", export.FORMAT_JSONL)
+    assert diff.load_export(path) == ([(0x401000, "AES", b"\x63\x7c"), (0x402000, "MD5", b"\x01\x23")], 0)
+
+
+def test_load_export_csv(tmpdir):
+    path = written(tmpdir, "hits.csv", export.FORMAT_CSV)
+    assert diff.load_export(path) == ([(0x401000, "AES", b"\x63\x7c"), (0x402000, "MD5", b"\x01\x23")], 0)
+
+
+def test_load_export_batch(tmpdir):
+    records = [
+        {"file": "a.bin", "offset": 0x900, "ea": 0x20100, "rule": "Const", "identifier": "$c",
+         "data": "01234567"},
+        # File bytes not loaded
+        {"file": "a.bin", "offset": 0xc80, "ea": None, "rule": "Const", "identifier": "$c",
+         "data": "01234567"},
+        {"file": "b.bin", "error": "unreadable"},
+    ]
+    path = tmpdir.join("batch.jsonl")
+    path.write("".join(json.dumps(record, sort_keys=True) + "\n" for record in records))
+    assert diff.load_export(str(path)) == ([(0x20100, "Const", b"\x01\x23\x45\x67")], 1)
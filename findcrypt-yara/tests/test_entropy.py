@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import random
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from findcrypt3 import entropy
+
+
+def sample():
+    rng = random.Random(4)
+    parts = []
+    for i in range(12):
+        n = rng.randrange(0x100, 0x20000)
+        if i % 2:
+            parts.append(bytes(bytearray(rng.getrandbits(8) for _ in range(n))))
+        else:
+            parts.append(bytes(bytearray(rng.randrange(8) for _ in range(n))))
+    return b"".join(parts)
+
+
+def regions(data, base=0x1000):
+    view = memoryview(data)
+    return list(entropy.iter_regions([(base, base + len(data))],
+                                     lambda address, size: view[address - base:address - base + size]))
+
+
+def test_regions():
+    data = sample()
+    found = regions(data)
+    assert len(found) == 6
+    for start, end, value, head in found:
+        assert value > entropy.THRESHOLD
+        assert head == data[start - 0x1000:start - 0x1000 + entropy.HEAD_SIZE]
+
+
+def test_tracker_overlapping_feeds():
+    data = sample()
+    tracker = entropy.RegionTracker()
+    # Chunks as read by a stream scan: one byte before, overlap bytes after
+    for pos in range(0, len(data), 0x8000):
+        start = max(0, pos - 1)
+        tracker.feed(0x1000 + start, memoryview(data)[start:pos + 0x8000 + 0x100])
+    assert tracker.finish() == regions(data)
+
+
+def test_tracker_gap():
+    data = sample()
+    tracker = entropy.RegionTracker()
+    tracker.feed(0x1000, data)
+    tracker.feed(0x1000 + len(data) + 0x10000, data)
+    found = tracker.finish()
+    assert found == regions(data) + regions(data, 0x1000 + len(data) + 0x10000)
+
+
+def test_tracker_reused_buffer_views():
+    # Read callbacks return views on one buffer, overwritten by the next read
+    data = sample()
+    tracker = entropy.RegionTracker()
+    buf = bytearray(0x8000)
+    for pos in range(0, len(data), 0x8000):
+        chunk = data[pos:pos + 0x8000]
+        buf[:len(chunk)] = chunk
+        tracker.feed(0x1000 + pos, memoryview(buf)[:len(chunk)])
+    found = tracker.finish()
+    assert found == regions(data)
+    for start, end, value, head in found:
+        assert isinstance(head, bytes)
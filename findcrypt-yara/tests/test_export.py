@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+import json
+
+import pytest
+
+from findcrypt3 import export
+from findcrypt3.scanner import Hit
+
+RULES = """rule AES : crypto {
+  meta:
+    author = "someone"
+    version = 2
+  strings:
+    $c0 = { 63 7c 77 7b }
+  condition:
+    $c0
+}
+"""
+
+HITS = [Hit(0x401000, "AES", "$c0", b"\x63\x7c\x77\x7b"), Hit(0x402000, "MD5", "$c1", b"\x01\x23")]
+
+
+def segment_name(ea):
+    return ".text" if ea < 0x402000 else ".data"
+
+
+def test_format_for():
+    assert export.format_for("hits.CSV") == export.FORMAT_CSV
+    assert export.format_for("hits.jsonl") == export.FORMAT_JSONL
+    assert export.format_for("hits") == export.FORMAT_JSONL
+
+
+def test_rule_meta(tmpdir):
+    path = tmpdir.join("test.rules")
+    path.write(RULES)
+    assert export.rule_meta({"test": str(path)}) == {"AES": {"author": "someone", "version": "2"}}
+
+
+def test_write_hits_jsonl(tmpdir):
+    path = str(tmpdir.join("hits.jsonl"))
+    with export.open_output(path) as output:
+        count = export.write_hits(iter(HITS), output, export.FORMAT_JSONL,
+                                  {"AES": {"author": "someone"}}, segment_name)
+    assert count == 2
+    with open(path) as f:
+        records = [json.loads(line) for line in f]
+    assert records == [
+        {"ea": 0x401000, "segment": ".text", "rule": "AES", "identifier": "$c0", "data": "637c777b",
+         "meta": {"author": "someone"}},
+        {"ea": 0x402000, "segment": ".data", "rule": "MD5", "identifier": "$c1", "data": "0123", "meta": {}},
+    ]
+
+
+def test_write_hits_csv(tmpdir):
+    path = str(tmpdir.join("hits.csv"))
+    with export.open_output(path) as output:
+        export.write_hits(HITS, output, export.FORMAT_CSV, {"AES": {"author": "someone"}})
+    with io.open(path, newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows == [
+        export.FIELDS,
+        [str(0x401000), "", "AES", "$c0", "637c777b", '{"author": "someone"}'],
+        [str(0x402000), "", "MD5", "$c1", "0123", "{}"],
+    ]
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        export.HitWriter(io.StringIO(), "xml")
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+import random
+
+import pytest
+
+from findcrypt3 import hitcache
+
+
+def random_bytes(size, seed):
+    rng = random.Random(seed)
+    return bytes(bytearray(rng.getrandbits(8) for _ in range(size)))
+
+
+def test_block_cuts_bounds():
+    data = random_bytes(0x100000, 1)
+    cuts = hitcache.block_cuts(data)
+    assert cuts[-1] == len(data)
+    sizes = [b - a for a, b in zip([0] + cuts, cuts)]
+    assert all(size <= hitcache.MAX_BLOCK_SIZE for size in sizes)
+    assert all(size >= hitcache.MIN_BLOCK_SIZE for size in sizes[:-1])
+
+
+def test_block_cuts_follow_content():
+    pytest.importorskip("numpy")
+    library = random_bytes(0x100000, 2)
+    cuts = hitcache.block_cuts(library)
+    shifted = hitcache.block_cuts(random_bytes(12345, 3) + library)
+    # Past the first cut in the library, both are cut at the same bytes
+    assert [cut - 12345 for cut in shifted if cut - 12345 > cuts[0]] == cuts[1:]
+
+
+def test_block_cuts_runs():
+    pytest.importorskip("numpy")
+    for data in (b"\0" * 0x100000, b"\x90\xcc" * 0x80000):
+        assert hitcache.block_cuts(data)[:2] == [hitcache.MAX_BLOCK_SIZE, 2 * hitcache.MAX_BLOCK_SIZE]
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+from findcrypt3.immediates import IMM, REG, Constant, ConstantIndex, iter_function_constants, rule_constants
+
+
+def combined(instructions):
+    """Values yielded beyond the raw immediates of the instructions."""
+    raw = set((ea, value) for ea, mnem, operands in instructions for kind, value in operands if kind == IMM)
+    return [pair for pair in iter_function_constants(instructions) if pair not in raw]
+
+
+def test_arm_movw_movt():
+    code = [(0x100, "MOVW", [(REG, "r0"), (IMM, 0x2301)]),
+            (0x104, "MOVT", [(REG, "r0"), (IMM, 0x6745)])]
+    assert list(iter_function_constants(code)) == [(0x100, 0x2301), (0x104, 0x6745), (0x104, 0x67452301)]
+
+
+def test_mips_lui_ori():
+    code = [(0x100, "lui", [(REG, "$t0"), (IMM, 0xefcd)]),
+            (0x104, "ori", [(REG, "$t0"), (REG, "$t0"), (IMM, 0xab89)])]
+    assert combined(code) == [(0x104, 0xefcdab89)]
+
+
+def test_mips_lui_addiu_sign_extends():
+    # addiu adds a sign extended immediate: the high half is one less
+    code = [(0x100, "lui", [(REG, "$t0"), (IMM, 0xefcd)]),
+            (0x104, "addiu", [(REG, "$t1"), (REG, "$t0"), (IMM, 0xab89)])]
+    assert combined(code) == [(0x104, 0xefccab89)]
+    code[1] = (0x104, "addiu", [(REG, "$t1"), (REG, "$t0"), (IMM, 0x2301)])
+    assert combined(code) == [(0x104, 0xefcd2301)]
+
+
+def test_ppc_lis_addi():
+    code = [(0x100, "lis", [(REG, "r3"), (IMM, 0x6745)]),
+            (0x104, "addi", [(REG, "r3"), (REG, "r3"), (IMM, 0x2301)])]
+    assert combined(code) == [(0x104, 0x67452301)]
+
+
+def test_half_overwritten_in_between():
+    code = [(0x100, "lui", [(REG, "$t0"), (IMM, 0xefcd)]),
+            (0x104, "move", [(REG, "$t0"), (REG, "$t1")]),
+            (0x108, "ori", [(REG, "$t0"), (REG, "$t0"), (IMM, 0xab89)])]
+    assert combined(code) == []
+    code = [(0x100, "movw", [(REG, "r0"), (IMM, 0x2301)]),
+            (0x104, "movt", [(REG, "r1"), (IMM, 0x6745)])]
+    assert combined(code) == []
+
+
+def test_constant_index():
+    index = ConstantIndex([(0x100, 0x67452301), (0x200, 0xff), (0x300, 0x67452301), (0x400, 0xefcdab89)])
+    # Small values are left out
+    assert len(index) == 3
+    assert index.find(0x67452301) == [0x100, 0x300]
+    assert index.find(0xff) == []
+
+
+def test_constant_index_match_once_per_rule():
+    index = ConstantIndex([(0x100, 0x67452301), (0x100, 0x67452301), (0x200, 0xefcdab89)])
+    md5 = Constant("MD5", "$c0", b"\x01\x23\x45\x67")
+    sha1 = Constant("SHA1", "$c0", b"\x01\x23\x45\x67")
+    md5_be = Constant("MD5", "$c1", b"\x67\x45\x23\x01")
+    constants = {0x67452301: [md5, sha1, md5_be], 0x12345678: [md5]}
+    assert list(index.match(constants)) == [(0x100, md5), (0x100, sha1)]
+
+
+def test_rule_constants(tmpdir):
+    path = tmpdir.join("test.rules")
+    path.write("rule MD5 {\n"
+               "  strings:\n"
+               "    $c0 = { 01 23 45 67 }\n"
+               "    $c1 = { 89 ab cd ef fe dc ba 98 }\n"
+               "    $c2 = { 01 23 45 }\n"
+               "    $c3 = { 00 00 01 00 }\n"
+               "  condition:\n"
+               "    any of them\n"
+               "}\n")
+    constants = rule_constants({"test": str(path)})
+    c0 = Constant("MD5", "$c0", b"\x01\x23\x45\x67")
+    c1 = Constant("MD5", "$c1", b"\x89\xab\xcd\xef\xfe\xdc\xba\x98")
+    c3 = Constant("MD5", "$c3", b"\x00\x00\x01\x00")
+    assert constants[0x67452301] == [c0]
+    assert constants[0x01234567] == [c0]
+    assert constants[0x98badcfeefcdab89] == [c1]
+    assert constants[0x89abcdeffedcba98] == [c1]
+    # 0x00010000 in little endian order; 0x00000100 is too small
+    assert constants[0x10000] == [c3]
+    assert sorted(constants) == sorted([0x67452301, 0x01234567, 0x98badcfeefcdab89, 0x89abcdeffedcba98, 0x10000])
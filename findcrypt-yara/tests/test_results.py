@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+from findcrypt3.results import ResultStore
+
+
+def store():
+    values = ResultStore()
+    values.add_data(0x100, "AES", b"\x63\x7c")
+    values.add_data(0x180, "High_Entropy", b"\x01\x02")
+    values.add_data(0x200, "MD5", b"\x01\x23")
+    values.add_data(0x400, "AES", b"\x63\x7c")
+    return values
+
+
+def test_discard():
+    values = store()
+    assert values.discard([(0x100, 0x201)]) == [(0x100, "AES"), (0x180, "High_Entropy"), (0x200, "MD5")]
+    assert list(values) == [(0x400, "AES", b"\x63\x7c")]
+
+
+def test_discard_rule_filter():
+    values = store()
+    removed = values.discard([(0x100, 0x201), (0x300, 0x400)], lambda rule: rule != "High_Entropy")
+    assert removed == [(0x100, "AES"), (0x200, "MD5")]
+    assert list(values) == [(0x180, "High_Entropy", b"\x01\x02"), (0x400, "AES", b"\x63\x7c")]
+
+
+def test_detach():
+    memory = bytearray(b"\x00\x63\x7c\x00\x01\x23")
+    values = ResultStore(memory)
+    values.add(0x401001, "AES", 1, 2)
+    values.add_data(0x500000, "High_Entropy", b"\xff\xfe")
+    values.add(0x401004, "MD5", 4, 2)
+    values.detach()
+    assert values.source is None
+    memory[:] = b"\x00" * len(memory)
+    assert list(values) == [(0x401001, "AES", b"\x63\x7c"), (0x500000, "High_Entropy", b"\xff\xfe"),
+                            (0x401004, "MD5", b"\x01\x23")]
+    values.add_data(0x600000, "SHA1", b"\x67\x45")
+    assert values[3] == (0x600000, "SHA1", b"\x67\x45")
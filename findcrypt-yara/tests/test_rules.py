@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+yara = pytest.importorskip("yara")
+
+from findcrypt3 import rules as rulesmod
+
+SOURCE = """import "pe"
+// Crypto rules
+
+rule First : crypto
+{
+  meta:
+    author = "someone"
+  strings:
+    $a = "first"
+  condition:
+    $a
+}
+
+private rule Helper { condition: true }
+/*
+rule Disabled { condition: true }
+*/
+global private rule Filter { condition: Helper }
+  rule Indented { strings: $a = "the rule keyword" condition: $a }
+"""
+
+
+def test_split_rules():
+    header, blocks = rulesmod.split_rules(SOURCE)
+    assert header == 'import "pe"\n// Crypto rules\n\n'
+    assert [name for name, block in blocks] == ["First", "Helper", "Filter", "Indented"]
+    assert blocks[0][1].startswith("rule First : crypto\n{")
+    # The commented out rule stays in the block before it
+    assert "rule Disabled" in blocks[1][1]
+    assert blocks[2][1] == "global private rule Filter { condition: Helper }\n"
+    assert header + "".join(block for name, block in blocks) == SOURCE
+
+
+def test_split_rules_without_rules():
+    assert rulesmod.split_rules("// nothing\n") == ("// nothing\n", [])
+
+
+def test_prune_rules(tmpdir):
+    path = tmpdir.join("test.rules")
+    path.write(SOURCE)
+    filepaths = {"test": str(path)}
+    profile = [
+        {"namespace": "test", "rule": "First", "time": 0.5},
+        {"namespace": "test", "rule": "Indented", "time": 0.01},
+        {"namespace": "test", "rule": "Helper", "time": None},
+    ]
+    pruned = rulesmod.prune_rules(filepaths, profile, 0.1, str(tmpdir.join("pruned")))
+    with open(pruned["test"]) as f:
+        header, blocks = rulesmod.split_rules(f.read())
+    assert header.startswith('import "pe"')
+    assert [name for name, block in blocks] == ["Helper", "Filter", "Indented"]
+    yara.compile(filepaths=pruned)
+
+
+def test_profile_rules(tmpdir):
+    path = tmpdir.join("test.rules")
+    path.write(SOURCE)
+    profile = rulesmod.profile_rules({"test": str(path)}, b"first, the rule keyword, first")
+    by_rule = dict((entry["rule"], entry) for entry in profile)
+    assert sorted(by_rule) == ["Filter", "First", "Helper", "Indented"]
+    assert by_rule["First"]["hits"] == 2
+    assert by_rule["Indented"]["hits"] == 1
+    # Filter uses Helper and cannot be compiled alone
+    assert by_rule["Filter"]["error"] and by_rule["Filter"]["time"] is None
+    assert by_rule["First"]["time"] is not None
+    table = rulesmod.format_profile(profile)
+    assert "Filter" in table and "(all rules)" in table
+
+
+def test_rule_info():
+    header, blocks = rulesmod.split_rules(SOURCE)
+    assert rulesmod.rule_info(blocks[0][1]) == (["crypto"], {"author": "someone"})
+    assert rulesmod.rule_info(blocks[1][1]) == ([], {})
+    tags, meta = rulesmod.rule_info('rule AES : crypto aes {\n'
+                                    '  meta:\n'
+                                    '    description = "AES S-box"\n'
+                                    '    version = 2\n'
+                                    '  condition: true\n'
+                                    '}\n')
+    assert tags == ["crypto", "aes"]
+    assert meta == {"description": "AES S-box", "version": "2"}
+
+
+@pytest.mark.parametrize("name, selection, selected", [
+    ("AES_sbox", {}, True),
+    ("AES_sbox", {"names": ["AES_*"]}, True),
+    ("aes_sbox", {"names": ["AES_*"]}, False),
+    ("AES_sbox", {"names": ["MD5*", "AES*"]}, True),
+    ("AES_sbox", {"tags": ["hash"]}, False),
+    ("AES_sbox", {"tags": ["hash", "aes"]}, True),
+    ("AES_sbox", {"meta": {"description": "*s-BOX*"}}, True),
+    ("AES_sbox", {"meta": {"description": "*s-box*", "author": "*"}}, True),
+    ("AES_sbox", {"meta": {"author": "?*"}}, False),
+    ("AES_sbox", {"names": ["AES_*"], "exclude": ["*_sbox"]}, False),
+    ("AES_sbox", {"exclude": ["MD5*"]}, True),
+])
+def test_rule_selected(name, selection, selected):
+    tags, meta = ["crypto", "aes"], {"description": "AES S-box"}
+    assert rulesmod.rule_selected(name, tags, meta, selection) == selected
+
+
+def test_select_rules(tmpdir):
+    path = tmpdir.join("test.rules")
+    path.write(SOURCE)
+    output_dir = str(tmpdir.join("selected"))
+    selected = rulesmod.select_rules({"test": str(path)}, {"tags": ["crypto"]}, output_dir)
+    with open(selected["test"]) as f:
+        header, blocks = rulesmod.split_rules(f.read())
+    assert [name for name, block in blocks] == ["First"]
+    yara.compile(filepaths=selected)
+    # Another selection is written to another directory
+    other = rulesmod.select_rules({"test": str(path)}, {"exclude": ["First"]}, output_dir)
+    assert other["test"] != selected["test"]
+    assert rulesmod.select_rules({"test": str(path)}, {"tags": ["crypto"]}, output_dir) == selected
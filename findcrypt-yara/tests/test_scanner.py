@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+yara = pytest.importorskip("yara")
+
+from findcrypt3 import scanner
+from findcrypt3.scanner import REGEX_MAX_LENGTH, iter_chunks, iter_stream_hits, string_max_length
+
+
+@pytest.mark.parametrize("value, modifiers, length", [
+    ('"abc"', "", 3),
+    ('"a\\\\b\\x41\\n"', "", 5),
+    ('"abc"', "wide ascii", 6),
+    ('"abcdef"', "base64", 12),
+    ('"abcdef"', 'base64("!@#$%^&*(){}[].,|ABCDEFGHIJ\\x09LMNOPQRSTUVWXYZabcdefghijklmnopqrstu")', 12),
+    ('"abcdef"', "base64wide", 24),
+    ('{ 01 02 03 }', "", 3),
+    ('{ 01 ?? (02 03 | 04) [2-4] 05 }', "", 10),
+    ('{ 01 [2-] 05 }', "", REGEX_MAX_LENGTH),
+    ('/abc/is', "", 3),
+    ('/(abcd){8}/', "", 32),
+    ('/(ab){2}(c(de){3}){2}/', "", 18),
+    ('/a(b|cde)f/', "", 5),
+    ('/[)(]{3}\\x41{2,4}?/', "", 7),
+    ('/^\\bab$/', "", 2),
+    ('/ab+c/', "", REGEX_MAX_LENGTH),
+    ('/(ab){2,}/', "", REGEX_MAX_LENGTH),
+    ('/a{2}/', "wide", 4),
+])
+def test_string_max_length(value, modifiers, length):
+    assert string_max_length(value, modifiers) == length
+
+
+def test_longest_string_length(tmpdir):
+    path = tmpdir.join("test.rules")
+    path.write('rule a { strings: $a = "abc" $b = /(abcd){8}/ condition: any of them }\n')
+    assert scanner.longest_string_length([str(path)]) == 32
+
+
+def test_iter_chunks_ownership():
+    units = list(iter_chunks(0x1000, 0x3800, 0x1000, 0x20))
+    assert units == [
+        (0x1000, 0x2000, 0x1000, 0x2020),
+        (0x2000, 0x3000, 0x1fff, 0x3020),
+        (0x3000, 0x3800, 0x2fff, 0x3800),
+    ]
+    # The owned parts partition the range
+    assert [(own_start, own_end) for own_start, own_end, _, _ in units] == \
+        [(0x1000, 0x2000), (0x2000, 0x3000), (0x3000, 0x3800)]
+
+
+def stream(rules, data, chunk_size, overlap):
+    view = memoryview(data)
+    return [(hit.address, hit.rule, bytes(hit.data))
+            for hit in iter_stream_hits(rules, [(0, len(data))], lambda address, size: view[address:address + size],
+                                        chunk_size, overlap)]
+
+
+def test_iter_stream_hits_across_chunks():
+    source = "rule Group { strings: $a = /(abcd){8}/ condition: $a }"
+    rules = yara.compile(source=source)
+    data = bytearray(0x3000)
+    data[0xffc:0xffc + 32] = b"abcd" * 8
+    overlap = string_max_length("/(abcd){8}/")
+    expected = [(0xffc, "Group", b"abcd" * 8)]
+    assert stream(rules, bytes(data), 0x2000, overlap) == expected
+    assert stream(rules, bytes(data), 0x1000, overlap) == expected
+
+
+def test_iter_stream_hits_each_hit_once():
+    rules = yara.compile(source="rule Const { strings: $c = { 01 23 45 67 } condition: $c }")
+    data = bytearray(0x3000)
+    for address in (0, 0xffc, 0x1000, 0x1ffe, 0x2ffc):
+        data[address:address + 4] = b"\x01\x23\x45\x67"
+    hits = stream(rules, bytes(data), 0x1000, 4)
+    assert [hit[0] for hit in hits] == [0, 0xffc, 0x1000, 0x1ffe, 0x2ffc]
+
+
+def test_iter_stream_hits_fullword_at_chunk_start():
+    rules = yara.compile(source='rule Word { strings: $w = "key" fullword condition: $w }')
+    data = bytearray(b"." * 0x2000)
+    # Preceded by a word character in the previous chunk: not a full word
+    data[0xfff:0x1003] = b"xkey"
+    data[0x1800:0x1803] = b"key"
+    assert [hit[0] for hit in stream(rules, bytes(data), 0x1000, 3)] == [0x1800]
+
+
+def test_budget_hit_cap():
+    budget = scanner.ScanBudget(max_hits_per_rule=2)
+    hits = [scanner.Hit(n, "AES" if n % 2 else "MD5", "$a", b"") for n in range(7)]
+    assert [hit.address for hit in hits if budget.accept(hit)] == [0, 1, 2, 3]
+    assert budget.dropped == {"AES": 1, "MD5": 2}
+    assert budget.cut_count() == 3
+    assert budget.summary() == ("AES: 1 hits over the limit of 2 dropped\n"
+                                "MD5: 2 hits over the limit of 2 dropped")
+
+
+def test_budget_match_timeout(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(scanner.timeit, "default_timer", lambda: now[0])
+    assert scanner.ScanBudget().match_timeout() is None
+    budget = scanner.ScanBudget(timeout=10, chunk_timeout=3)
+    budget.start()
+    assert budget.match_timeout() == 3
+    now[0] = 108.5
+    # Whole seconds, rounded up
+    assert budget.match_timeout() == 2
+    now[0] = 109.9
+    assert budget.match_timeout() == 1
+    assert not budget.expired()
+    now[0] = 110.0
+    assert budget.expired()
+    # Starting again does not move the deadline
+    budget.start()
+    assert budget.expired()
+
+
+def test_budget_skips_chunks_after_deadline(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(scanner.timeit, "default_timer", lambda: now[0])
+    rules = yara.compile(source="rule Const { strings: $c = { 01 23 45 67 } condition: $c }")
+    data = bytearray(0x3000)
+    data[0x2100:0x2104] = b"\x01\x23\x45\x67"
+    view = memoryview(bytes(data))
+
+    def read(address, size):
+        # The deadline passes while the first chunk is read
+        now[0] += 6
+        return view[address:address + size]
+
+    budget = scanner.ScanBudget(timeout=5)
+    assert list(iter_stream_hits(rules, [(0, len(data))], read, 0x1000, 4, budget)) == []
+    assert budget.skipped == [(0x1000, 0x2000, "scan timeout"), (0x2000, 0x3000, "scan timeout")]
+    assert budget.summary() == "0x1000-0x2000 not scanned (scan timeout)\n0x2000-0x3000 not scanned (scan timeout)"
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from findcrypt3.segmap import SegmentMap
+
+
+def segments():
+    segments = SegmentMap()
+    segments.add(0x400000, 0, 0x100)
+    segments.add(0x600000, 0x100, 0x180)
+    # Gap in the buffer between 0x180 and 0x200
+    segments.add(0x10000, 0x200, 0x300)
+    return segments
+
+
+def test_to_ea():
+    s = segments()
+    assert s.to_ea(0) == 0x400000
+    assert s.to_ea(0xff) == 0x4000ff
+    assert s.to_ea(0x100) == 0x600000
+    assert s.to_ea(0x180) is None
+    assert s.to_ea(0x250) == 0x10050
+    assert s.to_ea(0x300) is None
+
+
+def test_to_eas_matches_to_ea():
+    s = segments()
+    offsets = [0x2ff, 0, 0x1ff, 0x100, 0x17f, 0x400, 0x100, 0x50]
+    assert s.to_eas(offsets) == [s.to_ea(offset) for offset in offsets]
+
+
+def test_find_and_iter():
+    s = segments()
+    assert len(s) == 3
+    assert [s.find(offset) for offset in (0, 0x120, 0x1c0, 0x200)] == [0, 1, -1, 2]
+    assert list(s)[1] == (0x600000, 0x100, 0x180)
+
+
+def test_add_out_of_order():
+    s = segments()
+    with pytest.raises(ValueError):
+        s.add(0, 0x2f0, 0x400)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+yara = pytest.importorskip("yara")
+
+from findcrypt3 import rules as rulesmod
+from findcrypt3 import shard
+
+CRYPTO = """import "math"
+
+rule Base { strings: $a = { 01 02 03 04 } condition: $a }
+rule UsesBase { strings: $a = { 05 06 07 08 } condition: $a and Base }
+rule Regex { strings: $a = /abc[0-9]{4}/ $b = /def+/ condition: any of them }
+rule Plain1 { strings: $a = "one" condition: $a }
+rule Plain2 { strings: $a = "two" $b = "three" condition: any of them }
+"""
+
+FILTERED = """global rule OnlyPE { condition: uint16(0) == 0x5a4d }
+rule Hidden { strings: $a = "hidden" condition: $a }
+"""
+
+
+def rule_names(filepaths):
+    names = []
+    for namespace in sorted(filepaths):
+        with open(filepaths[namespace]) as f:
+            names.extend((namespace, name) for name, block in rulesmod.split_rules(f.read())[1])
+    return names
+
+
+def write(tmpdir):
+    filepaths = {}
+    for namespace, source in (("crypto", CRYPTO), ("filtered", FILTERED)):
+        path = tmpdir.join(namespace + ".rules")
+        path.write(source)
+        filepaths[namespace] = str(path)
+    return filepaths
+
+
+def test_rule_cost():
+    assert shard.rule_cost('rule A { condition: true }') == 1
+    assert shard.rule_cost('rule A { strings: $a = "x" $b = { 01 } condition: any of them }') == 3
+    assert shard.rule_cost('rule A { strings: $a = /x+/ condition: $a }') == 1 + shard.REGEX_WEIGHT
+
+
+def test_shard_rules(tmpdir):
+    filepaths = write(tmpdir)
+    shards = shard.shard_rules(filepaths, 3, str(tmpdir.join("shards")))
+    assert len(shards) == 3
+    placed = [rule_names(shard_paths) for shard_paths in shards]
+    # Every rule in exactly one shard
+    assert sorted(sum(placed, [])) == sorted(rule_names(filepaths))
+    for names in placed:
+        # Rules using each other, and global rules with their file, stay together
+        assert (("crypto", "Base") in names) == (("crypto", "UsesBase") in names)
+        assert (("filtered", "OnlyPE") in names) == (("filtered", "Hidden") in names)
+    for shard_paths in shards:
+        yara.compile(filepaths=shard_paths)
+
+
+def test_shard_rules_balanced(tmpdir):
+    filepaths = write(tmpdir)
+    shards = shard.shard_rules(filepaths, 2, str(tmpdir.join("shards")))
+    # The regexp rule alone weighs more than all the others
+    assert [("crypto", "Regex")] in [rule_names(shard_paths) for shard_paths in shards]
+
+
+def test_shard_rules_more_shards_than_groups(tmpdir):
+    filepaths = write(tmpdir)
+    shards = shard.shard_rules(filepaths, 16, str(tmpdir.join("shards")))
+    assert len(shards) == 5
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+from findcrypt3.watch import DirtyRanges, rescan_units
+
+
+def test_dirty_ranges_merge():
+    dirty = DirtyRanges()
+    dirty.add(0x100, 0x101)
+    dirty.add(0x200, 0x204)
+    dirty.add(0x50, 0x60)
+    assert list(dirty) == [(0x50, 0x60), (0x100, 0x101), (0x200, 0x204)]
+    # Touching ranges are merged
+    dirty.add(0x101, 0x102)
+    dirty.add(0x4f, 0x50)
+    assert list(dirty) == [(0x4f, 0x60), (0x100, 0x102), (0x200, 0x204)]
+    # A range covering several ranges replaces them
+    dirty.add(0x5f, 0x200)
+    assert list(dirty) == [(0x4f, 0x204)]
+    assert len(dirty) == 1
+
+
+def test_dirty_ranges_pop_all():
+    dirty = DirtyRanges()
+    dirty.add(0x10, 0x20)
+    assert dirty.pop_all() == [(0x10, 0x20)]
+    assert len(dirty) == 0
+    assert dirty.pop_all() == []
+
+
+def test_rescan_units():
+    bounds = [(0x1000, 0x2000), (0x3000, 0x4000)]
+    units = rescan_units([(0x1800, 0x1801)], bounds, 0x40)
+    assert units == [(0x17c0, 0x1802, 0x17bf, 0x1842)]
+
+
+def test_rescan_units_clipped_to_bounds():
+    bounds = [(0x1000, 0x2000), (0x3000, 0x4000)]
+    units = rescan_units([(0x1010, 0x1011), (0x1ff0, 0x1ff8)], bounds, 0x40)
+    assert units == [(0x1000, 0x1012, 0x1000, 0x1052), (0x1fb0, 0x1ff9, 0x1faf, 0x2000)]
+    # Ranges outside the bounds give no unit
+    assert rescan_units([(0x2800, 0x2900)], bounds, 0x40) == []
+
+
+def test_rescan_units_merged():
+    bounds = [(0x1000, 0x2000)]
+    units = rescan_units([(0x1100, 0x1101), (0x1120, 0x1121)], bounds, 0x40)
+    assert units == [(0x10c0, 0x1122, 0x10bf, 0x1162)]
+
+
+def test_rescan_units_spanning_segments():
+    bounds = [(0x1000, 0x2000), (0x2000, 0x3000)]
+    units = rescan_units([(0x2010, 0x2011)], bounds, 0x40)
+    # Matches starting at the end of the previous segment are rescanned too
+    assert units == [(0x1fd0, 0x2000, 0x1fcf, 0x2000), (0x2000, 0x2012, 0x2000, 0x2052)]